@@ -0,0 +1,259 @@
+"""Benchmarks for building and writing Testspace reports at production sizes.
+
+Each scenario runs in its own process so peak memory is measured cleanly, and
+is repeated; the best timings and the median sizes are kept. Results are
+compared against a stored baseline and the script exits with a non-zero
+status when a metric regresses beyond the tolerance:
+
+    python benchmarks/bench_report.py                  # default scenarios
+    python benchmarks/bench_report.py --full           # include 1M test cases
+    python benchmarks/bench_report.py -s flat_1k -s deep_tree --repeat 9
+    python benchmarks/bench_report.py --update-baseline
+
+Timings depend on the machine, regenerate the baseline on the machine that
+runs the comparison.
+"""
+from __future__ import print_function
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from python_testspace_xml import testspace_xml  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+STATUSES = ['passed'] * 8 + ['failed', 'errored', 'not_applicable']
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def build_flat(count, suites=100, columnar=False):
+    def build(work_dir):
+        rng = random.Random(count)
+        report = testspace_xml.TestspaceReport()
+        report.set_columnar(columnar)
+        suite_list = [report.get_or_add_suite_path(['pkg {0}'.format(s % 10), 'module {0}'.format(s)])
+                      for s in range(suites)]
+        for i in range(count):
+            suite = suite_list[i % suites]
+            if columnar:
+                suite.add_test_case_record('test_{0}'.format(i), rng.choice(STATUSES), rng.random() * 100)
+            else:
+                test_case = testspace_xml.TestCase('test_{0}'.format(i), rng.choice(STATUSES))
+                test_case.set_duration(rng.random() * 100)
+                suite.add_test_case(test_case)
+        return report
+    return build
+
+
+def build_deep_tree(depth=12, branching=3, cases=5):
+    def build(work_dir):
+        report = testspace_xml.TestspaceReport()
+
+        def fill(path, level):
+            suite = report.get_or_add_suite_path(path)
+            for c in range(cases):
+                suite.add_test_case(testspace_xml.TestCase('case {0}'.format(c)))
+            if level < depth:
+                for b in range(branching if level < 8 else 1):
+                    fill(path + ['level {0} branch {1}'.format(level, b)], level + 1)
+
+        fill(['root'], 1)
+        return report
+    return build
+
+
+def build_heavy_annotations(cases=100, buffer_size=64 * 1024, lazy=False):
+    def build(work_dir):
+        rng = random.Random(cases)
+        log_path = os.path.join(work_dir, 'shared.log')
+        with io.open(log_path, 'wb') as file_obj:
+            for i in range(5000):
+                file_obj.write('{0} INFO worker {1} finished step {2}\n'.format(
+                    i, rng.randint(0, 31), rng.randint(0, 1000)).encode())
+        # a few distinct payloads, so generating them doesn't dominate the build time
+        words = ['alpha', 'beta', 'gamma', 'delta', 'error:', 'ok', '\n']
+        texts = [' '.join(rng.choice(words) for _ in range(buffer_size // 6)) for _ in range(8)]
+
+        report = testspace_xml.TestspaceReport()
+        suite = report.get_or_add_test_suite('artifacts')
+        for i in range(cases):
+            test_case = testspace_xml.TestCase('case {0}'.format(i))
+            test_case.add_string_buffer_annotation('stdout', texts[i % len(texts)], lazy=lazy)
+            test_case.add_file_annotation('log', log_path, lazy=lazy)
+            suite.add_test_case(test_case)
+        return report
+    return build
+
+
+def build_unicode_strings(count=20000):
+    def build(work_dir):
+        rng = random.Random(count)
+        alphabet = u'abc éü中文\U0001f600\x01\x0b\x1f￾\x7f&<>"'
+        report = testspace_xml.TestspaceReport()
+        suite = report.get_or_add_test_suite(u'unicode é suite')
+        for i in range(count):
+            name = u''.join(rng.choice(alphabet) for _ in range(30)) + str(i)
+            test_case = testspace_xml.TestCase(name)
+            test_case.set_description(u''.join(rng.choice(alphabet) for _ in range(60)))
+            test_case.add_text_annotation(rng.choice([u'Error', u'Info', u'café\x02']), 'info', name)
+            suite.add_test_case(test_case)
+        return report
+    return build
+
+
+SCENARIOS = [
+    # name, builder, write modes, included by default
+    ('flat_1k', build_flat(1000), ('dom', 'streaming'), True),
+    ('flat_100k', build_flat(100000), ('dom', 'streaming'), True),
+    ('flat_100k_columnar', build_flat(100000, columnar=True), ('streaming',), True),
+    ('flat_1m', build_flat(1000000), ('streaming',), False),
+    ('flat_1m_columnar', build_flat(1000000, columnar=True), ('streaming',), False),
+    ('deep_tree', build_deep_tree(), ('dom', 'streaming'), True),
+    ('heavy_annotations', build_heavy_annotations(), ('dom', 'streaming'), True),
+    ('heavy_annotations_lazy', build_heavy_annotations(lazy=True), ('streaming',), True),
+    ('unicode_strings', build_unicode_strings(), ('dom', 'streaming'), True),
+]
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_scenario(name, mode, queue):
+    builder = dict((s[0], s[1]) for s in SCENARIOS)[name]
+    work_dir = tempfile.mkdtemp(prefix='testspace_bench_')
+    try:
+        start = clock()
+        report = builder(work_dir)
+        build_time = clock() - start
+
+        out_file = os.path.join(work_dir, 'report.xml')
+        start = clock()
+        report.write_xml(out_file, streaming=(mode == 'streaming'))
+        write_time = clock() - start
+
+        queue.put({
+            'build_seconds': round(build_time, 4),
+            'write_seconds': round(write_time, 4),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'output_bytes': os.path.getsize(out_file),
+        })
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def measure_once(name, mode):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_scenario, args=(name, mode, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def measure(name, mode, repeat):
+    # other load on the machine only ever slows a run down, so the fastest run is
+    # the least noisy timing; sizes barely vary and take the median
+    runs = [measure_once(name, mode) for _ in range(repeat)]
+    result = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        if not values:
+            result[metric] = None
+        elif metric.endswith('_seconds'):
+            result[metric] = min(values)
+        else:
+            result[metric] = sorted(values)[len(values) // 2]
+    return result
+
+
+def compare(results, baseline, time_tolerance, size_tolerance, min_seconds):
+    regressions = []
+    for key, metrics in sorted(results.items()):
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric, value in sorted(metrics.items()):
+            old = previous.get(metric)
+            if value is None or not old:
+                continue
+            if metric.endswith('_seconds'):
+                # differences in very short timings are noise
+                if value - old < min_seconds:
+                    continue
+                tolerance = time_tolerance
+            else:
+                tolerance = size_tolerance
+            if value > old * (1 + tolerance):
+                regressions.append((key, metric, old, value))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Testspace report construction and serialization.')
+    parser.add_argument('-s', '--scenario', action='append', help='scenario to run (repeatable)')
+    parser.add_argument('--full', action='store_true', help='also run the 1M test case scenarios')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline results file')
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help='allowed relative slowdown')
+    parser.add_argument('--size-tolerance', type=float, default=0.10, help='allowed relative memory/output growth')
+    parser.add_argument('--min-seconds', type=float, default=0.2, help='ignore slowdowns smaller than this')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per scenario, the best timing is kept')
+    parser.add_argument('--list', action='store_true', help='list scenarios and exit')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, _, modes, default in SCENARIOS:
+            print('{0:28} {1:20} {2}'.format(name, ','.join(modes), 'default' if default else '--full'))
+        return 0
+
+    selected = [s for s in SCENARIOS if (s[0] in args.scenario if args.scenario else (s[3] or args.full))]
+    results = {}
+    for name, _, modes, _ in selected:
+        for mode in modes:
+            key = '{0}/{1}'.format(name, mode)
+            results[key] = measure(name, mode, max(1, args.repeat))
+            metrics = results[key]
+            print('{0:36} build {1:8.3f}s  write {2:8.3f}s  rss {3:>8} MB  output {4:>10} bytes'.format(
+                key, metrics['build_seconds'], metrics['write_seconds'],
+                (metrics['peak_rss_bytes'] or 0) // (1024 * 1024), metrics['output_bytes']))
+
+    if args.output:
+        with open(args.output, 'w') as file_obj:
+            json.dump(results, file_obj, indent=2, sort_keys=True)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as file_obj:
+            baseline = json.load(file_obj)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as file_obj:
+            json.dump(baseline, file_obj, indent=2, sort_keys=True)
+            file_obj.write('\n')
+        return 0
+
+    regressions = compare(results, baseline, args.time_tolerance, args.size_tolerance, args.min_seconds)
+    for key, metric, old, value in regressions:
+        print('REGRESSION {0} {1}: {2} -> {3}'.format(key, metric, old, value))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
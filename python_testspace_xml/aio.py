@@ -0,0 +1,148 @@
+import asyncio
+import functools
+
+from .testspace_xml import StreamingXmlWriter, XmlWriter, collect_stats, open_output, stats_count, stats_phase, \
+    suite_custom_data
+
+WRITE_CHUNK_SIZE = 256 * 1024
+
+
+async def add_file_annotation(owner, name, file_path, level='info', description='', mime_type='text/plain',
+                              executor=None, **kwargs):
+    # the annotation takes its place in the list immediately, only the gzip work is offloaded
+    fa = owner.add_text_annotation(name, level, description)
+    loop = asyncio.get_event_loop()
+    kwargs.setdefault('payload_index', owner.get_payload_index())
+    kwargs.setdefault('payload_budget', owner.get_payload_budget())
+    kwargs.setdefault('compression_executor', owner.get_compression_executor())
+    await loop.run_in_executor(executor, functools.partial(fa.set_file, file_path, mime_type, **kwargs))
+    return fa
+
+
+async def add_string_buffer_annotation(owner, name, string_buffer, level='info', description='',
+                                       mime_type='text/plain', executor=None, **kwargs):
+    ba = owner.add_text_annotation(name, level, description)
+    kwargs.setdefault('payload_index', owner.get_payload_index())
+    kwargs.setdefault('payload_budget', owner.get_payload_budget())
+    kwargs.setdefault('compression_executor', owner.get_compression_executor())
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(
+        executor, functools.partial(ba.set_buffer, string_buffer, mime_type, **kwargs))
+    return ba
+
+
+class _ChunkBuffer:
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+
+    def take(self):
+        data = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+class AsyncXmlWriter(StreamingXmlWriter):
+    # serializes on the event loop in small steps; compression of pending payloads
+    # and file writes run in the executor
+    def __init__(self, report, executor=None, chunk_size=WRITE_CHUNK_SIZE):
+        StreamingXmlWriter.__init__(self, report)
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.file_obj = None
+
+    async def write_async(self, out_file, to_pretty=False, compress=None, compresslevel=9):
+        if to_pretty:
+            self.indent, self.newl = '\t', '\n'
+        else:
+            self.indent, self.newl = '', ''
+
+        self.out = _ChunkBuffer()
+        try:
+            with open_output(out_file, compress, compresslevel) as file_obj:
+                self.file_obj = file_obj
+                with stats_phase('serialization'):
+                    self.out.write('<?xml version="1.0" encoding="utf-8"?>' + self.newl)
+                    await self._write_suite_async(self.report.get_root_suite())
+                    await self._flush()
+        finally:
+            self.out = None
+            self.file_obj = None
+
+    async def _flush(self):
+        if not self.out.size:
+            return
+        data = self.out.take()
+        await asyncio.get_event_loop().run_in_executor(self.executor, self.file_obj.write, data)
+
+    async def _step(self):
+        if self.out.size >= self.chunk_size:
+            await self._flush()
+        else:
+            # let other coroutines run between elements
+            await asyncio.sleep(0)
+
+    async def _resolve_async(self, annotations):
+        loop = asyncio.get_event_loop()
+        for a in annotations:
+            if a.is_pending() or a.gzip_future is not None:
+                await loop.run_in_executor(self.executor, a.resolve)
+
+    async def _write_suite_async(self, test_suite):
+        if test_suite.is_root_suite:
+            tag = 'reporter'
+            attrs = XmlWriter.reporter_attributes(self.report)
+        else:
+            tag = 'test_suite'
+            attrs = XmlWriter.suite_attributes(test_suite)
+            stats_count('suites')
+
+        custom_data = suite_custom_data(test_suite, self.rollup)
+        has_children = bool(test_suite.annotations or custom_data or
+                            test_suite.test_case_count() or test_suite.sub_suites)
+        self.start_element(tag, attrs, has_children)
+        if not has_children:
+            return
+
+        for a in test_suite.annotations:
+            await self._resolve_async([a])
+            a.write_xml_stream(self)
+            await self._step()
+
+        for d in custom_data:
+            d.write_xml_stream(self)
+
+        for row in test_suite.iter_test_case_rows():
+            await self._resolve_async(row[5])
+            self._write_test_case(row)
+            await self._step()
+
+        # write child suites
+        for sub_suite in test_suite.sub_suites:
+            await self._write_suite_async(sub_suite)
+
+        self.end_element(tag)
+
+
+async def write_xml(report, out_file, to_pretty=False, executor=None, **kwargs):
+    # stats are collected for the whole write, including time other coroutines
+    # run while it waits, and only one report should be written at a time with them
+    stats = report._start_write_stats()
+    with collect_stats(stats):
+        with stats_phase('payload_budget'):
+            report.apply_payload_budget()
+        with stats_phase('deduplication'):
+            report.deduplicate_annotations()
+        compression_executor = report.get_compression_executor()
+        try:
+            if compression_executor is not None:
+                report.compress_annotations(compression_executor)
+            await AsyncXmlWriter(report, executor).write_async(out_file, to_pretty, **kwargs)
+        finally:
+            report.shutdown_compression_pool()
+    report._finish_write_stats(stats)
@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+import os
+from multiprocessing.connection import Client, Listener
+
+from .testspace_xml import Annotation, AnnotationComment, CustomData, TestCase
+
+# records are plain tuples, which pickle far smaller and faster than object graphs:
+#   (suite_names, name, description, status, start_time, duration, annotations, custom_data)
+# annotation payloads are compressed in the worker that produced them
+
+
+def encode_annotation(annotation):
+    return (annotation.name, annotation.level, annotation.description, annotation.mime_type,
+            annotation.file_path, annotation.link_file, annotation.resolve(),
+            tuple((c.name, c.comment) for c in annotation._comments or ()))
+
+
+def decode_annotation(record):
+    name, level, description, mime_type, file_path, link_file, gzip_data, comments = record
+    annotation = Annotation(name, level, description)
+    annotation.mime_type = mime_type
+    annotation.file_path = file_path
+    annotation.link_file = link_file
+    annotation.gzip_data = gzip_data
+    if comments:
+        annotation.comments = [AnnotationComment(c_name, comment) for c_name, comment in comments]
+    return annotation
+
+
+def encode_test_case(suite_names, test_case):
+    name, description, status, start_time, duration, annotations, custom_data = test_case.row()
+    return (tuple(suite_names), name, description, status, start_time, duration,
+            tuple(encode_annotation(a) for a in annotations),
+            tuple((d.name, d.value) for d in custom_data))
+
+
+def decode_test_case(record):
+    suite_names, name, description, status, start_time, duration, annotations, custom_data = record
+    test_case = TestCase(name, status)
+    test_case.description = description
+    test_case.start_time = start_time
+    test_case.duration = duration
+    if annotations:
+        test_case.annotations = [decode_annotation(a) for a in annotations]
+    if custom_data:
+        test_case.custom_data = [CustomData(d_name, value) for d_name, value in custom_data]
+    return suite_names, test_case
+
+
+class ResultSender:
+    # worker side; channel is a multiprocessing queue (put) or connection (send)
+    def __init__(self, channel, batch_size=256):
+        self.channel = channel
+        self.batch_size = batch_size
+        self.batch = []
+        self._put = channel.put if hasattr(channel, 'put') else channel.send
+
+    @classmethod
+    def connect(cls, address, authkey, batch_size=256):
+        # authkey is the collector's ResultCollector.authkey; the collector unpickles what senders send
+        if not authkey:
+            raise ValueError('an authkey is required to connect to a ResultCollector')
+        return cls(Client(address, authkey=authkey), batch_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def send(self, suite_names, test_case):
+        self.batch.append(encode_test_case(suite_names, test_case))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self._put(self.batch)
+            self.batch = []
+
+    def close(self):
+        if self.channel is None:
+            return
+        self.flush()
+        # tells the collector this sender is done
+        self._put(None)
+        if hasattr(self.channel, 'close') and not hasattr(self.channel, 'put'):
+            self.channel.close()
+        self.channel = None
+
+
+class ResultCollector:
+    # aggregator side; sink is a TestspaceReport, a TestSuite or an IncrementalXmlWriter
+    def __init__(self, sink, authkey=None):
+        self.sink = sink
+        self.received = 0
+        # serve() only accepts senders that know this key, since received batches are unpickled
+        self.authkey = authkey or os.urandom(32)
+
+    def add_batch(self, batch):
+        for record in batch:
+            suite_names, test_case = decode_test_case(record)
+            self.sink.add_test_case_to_path(suite_names, test_case)
+        self.received += len(batch)
+
+    def collect_from_queue(self, queue, senders):
+        remaining = senders
+        while remaining:
+            batch = queue.get()
+            if batch is None:
+                remaining -= 1
+            else:
+                self.add_batch(batch)
+        return self.sink
+
+    def serve(self, address, senders):
+        # accepts connections from ResultSender.connect(address, self.authkey) until all senders closed
+        from multiprocessing.connection import wait
+        listener = Listener(address, authkey=self.authkey)
+        try:
+            connections = [listener.accept() for _ in range(senders)]
+        finally:
+            listener.close()
+
+        while connections:
+            for conn in wait(connections):
+                try:
+                    batch = conn.recv()
+                except EOFError:
+                    batch = None
+                if batch is None:
+                    connections.remove(conn)
+                    conn.close()
+                else:
+                    self.add_batch(batch)
+        return self.sink
@@ -0,0 +1,158 @@
+from __future__ import absolute_import, print_function
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from .merge import write_merged_report
+from .reader import _iter_events
+from .testspace_xml import IncrementalXmlWriter, TestCase, TestSuite
+
+# elements dropped from the parsed tree once converted, so memory stays bounded
+JUNIT_ELEMENTS = ('testcase', 'testsuite')
+
+
+def _parse_seconds(value):
+    # JUnit times are seconds, durations here are milliseconds
+    if not value:
+        return 0
+    try:
+        return float(value.replace(',', '')) * 1000
+    except ValueError:
+        return 0
+
+
+def _make_suite(elem):
+    test_suite = TestSuite(elem.get('name') or 'unnamed')
+    test_suite.set_start_time(elem.get('timestamp'))
+    test_suite.set_duration(_parse_seconds(elem.get('time')))
+    return test_suite
+
+
+def _add_properties(target, elem):
+    for p_elem in elem.findall('property'):
+        target.add_custom_metric(p_elem.get('name'), p_elem.get('value', p_elem.text or ''))
+
+
+def _add_output(target, elem):
+    if elem.text and elem.text.strip():
+        level = 'warn' if elem.tag == 'system-err' else 'info'
+        target.add_string_buffer_annotation(elem.tag, elem.text, level)
+
+
+def _make_test_case(elem):
+    test_case = TestCase(elem.get('name') or 'unnamed')
+    test_case.set_start_time(elem.get('timestamp'))
+    test_case.set_duration(_parse_seconds(elem.get('time')))
+    for child in elem:
+        tag = child.tag
+        message = child.get('message') or child.get('type') or ''
+        if tag == 'failure':
+            test_case.fail(message)
+        elif tag == 'error':
+            test_case.block(message)
+        elif tag == 'skipped':
+            test_case.set_status('not_applicable')
+            if message:
+                test_case.add_info_annotation(message)
+        elif tag in ('system-out', 'system-err'):
+            _add_output(test_case, child)
+        elif tag == 'properties':
+            _add_properties(test_case, child)
+        if tag in ('failure', 'error') and child.text and child.text.strip():
+            test_case.add_string_buffer_annotation(tag, child.text, 'error' if tag == 'failure' else 'fatal')
+    return test_case
+
+
+def convert_events(events, writer, classname_suites=True):
+    # test cases of a suite are grouped into sub-suites by classname, unless that
+    # is just the suite name again (the usual layout of Java tools)
+    suites = []
+    class_suite = None
+    for event, elem, parent in events:
+        tag = elem.tag
+        if event == 'start':
+            if tag == 'testsuite':
+                if class_suite is not None:
+                    writer.close_suite()
+                    class_suite = None
+                suites.append(writer.open_suite(_make_suite(elem)))
+            continue
+
+        if tag == 'testcase':
+            group = elem.get('classname') if classname_suites or not suites else None
+            if not suites and not group:
+                group = 'unnamed'
+            if suites and group == suites[-1].name:
+                group = None
+            if class_suite is not None and class_suite.name != group:
+                writer.close_suite()
+                class_suite = None
+            if group and class_suite is None:
+                class_suite = writer.open_suite(group)
+            writer.add_test_case(_make_test_case(elem))
+        elif tag == 'testsuite':
+            if class_suite is not None:
+                writer.close_suite()
+                class_suite = None
+            writer.close_suite()
+            suites.pop()
+        elif suites and parent is not None and parent.tag == 'testsuite':
+            if tag == 'properties':
+                _add_properties(suites[-1], elem)
+            elif tag in ('system-out', 'system-err'):
+                _add_output(suites[-1], elem)
+    if class_suite is not None:
+        writer.close_suite()
+
+
+def convert_file(source, out_file, to_pretty=False, classname_suites=True, product_version=None):
+    with IncrementalXmlWriter(out_file, product_version, to_pretty, checkpoint_interval=None) as writer:
+        convert_events(_iter_events(source, JUNIT_ELEMENTS), writer, classname_suites)
+    return out_file
+
+
+def convert_files(sources, out_file, to_pretty=False, classname_suites=True, product_version=None,
+                  max_workers=None):
+    # each input is converted in a worker process, the results are then merged
+    # so suites with the same name from different inputs are combined
+    if len(sources) == 1:
+        return convert_file(sources[0], out_file, to_pretty, classname_suites, product_version)
+
+    work_dir = tempfile.mkdtemp(prefix='testspace_junit_')
+    try:
+        shard_files = [os.path.join(work_dir, '{0}.xml'.format(index)) for index in range(len(sources))]
+        if max_workers != 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+                futures = [executor.submit(convert_file, source, shard_file, False, classname_suites,
+                                           product_version)
+                           for source, shard_file in zip(sources, shard_files)]
+                for future in futures:
+                    future.result()
+        else:
+            for source, shard_file in zip(sources, shard_files):
+                convert_file(source, shard_file, False, classname_suites, product_version)
+        write_merged_report(shard_files, out_file, to_pretty, max_workers)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return out_file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert JUnit XML results to a Testspace XML report.')
+    parser.add_argument('inputs', nargs='+', help='JUnit XML files, optionally gzip compressed')
+    parser.add_argument('-o', '--output', required=True, help='Testspace report file')
+    parser.add_argument('--pretty', action='store_true', help='write indented output')
+    parser.add_argument('--flat', action='store_true', help='do not group test cases into suites by classname')
+    parser.add_argument('--product-version', default=None, help='product version of the report')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args(argv)
+    convert_files(args.inputs, args.output, to_pretty=args.pretty, classname_suites=not args.flat,
+                  product_version=args.product_version, max_workers=args.jobs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+from __future__ import absolute_import, print_function
+import argparse
+import codecs
+import io
+import os
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+
+from .reader import iter_report_events, load_report
+from .testspace_xml import StreamingXmlWriter, TestSuite, TestspaceReport, XmlWriter
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def merge_suite_attributes(target, source):
+    # the first shard to describe a suite wins, durations add up
+    if not target.description:
+        target.description = source.description
+    if not target.start_time:
+        target.start_time = source.start_time
+    target.duration += source.duration
+
+
+def merge_into(target, source):
+    if getattr(target, 'is_root_suite', False) and not target.product_version:
+        target.set_product_version(getattr(source, 'product_version', None))
+    for a in source.annotations:
+        target.add_annotation(a)
+    target.custom_data.extend(source.custom_data)
+    for tc in source.iter_test_cases():
+        target.add_test_case(tc)
+    for sub_suite in source.sub_suites:
+        child = target.get_or_add_test_suite(sub_suite.name)
+        merge_suite_attributes(child, sub_suite)
+        merge_into(child, sub_suite)
+    return target
+
+
+def merge_reports(sources):
+    # in-memory merge of report files and/or TestspaceReport objects
+    merged = TestspaceReport()
+    for source in sources:
+        if not isinstance(source, TestSuite):
+            source = load_report(source)
+        merge_into(merged, source)
+    return merged
+
+
+def _iter_object_events(report):
+    # the same events reader.iter_report_events produces, from an in-memory report
+    yield 'report', (), report
+
+    def walk(test_suite, suite_path):
+        for a in test_suite.annotations:
+            yield 'annotation', suite_path, a
+        for d in test_suite.custom_data:
+            yield 'custom_data', suite_path, d
+        for tc in test_suite.iter_test_cases():
+            yield 'test_case', suite_path, tc
+        for sub_suite in test_suite.sub_suites:
+            sub_path = suite_path + (sub_suite.name,)
+            yield 'suite_start', sub_path, sub_suite
+            for event in walk(sub_suite, sub_path):
+                yield event
+            yield 'suite_end', sub_path, sub_suite
+
+    for event in walk(report, ()):
+        yield event
+
+
+class _Spool:
+    # serialized fragments of one shard plus the byte ranges they occupy
+    def __init__(self, spool_path, to_pretty):
+        self.spool_path = spool_path
+        self.file_obj = io.open(spool_path, 'wb')
+        self.offset = 0
+        self.writer = StreamingXmlWriter(None)
+        if to_pretty:
+            self.writer.indent, self.writer.newl = '\t', '\n'
+
+    def add(self, ranges, write_fn, obj):
+        out = io.StringIO()
+        self.writer.out = out
+        write_fn(obj)
+        data = out.getvalue().encode('utf-8')
+        self.file_obj.write(data)
+        if ranges and ranges[-1][0] + ranges[-1][1] == self.offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + len(data))
+        else:
+            ranges.append((self.offset, len(data)))
+        self.offset += len(data)
+
+    def close(self):
+        self.file_obj.close()
+
+
+def _spool_events(events, spool_path, to_pretty):
+    spool = _Spool(spool_path, to_pretty)
+    shard = {'spool': spool_path, 'product_version': None, 'suites': OrderedDict()}
+    suites = shard['suites']
+
+    def entry(suite_path, test_suite=None):
+        suite_entry = suites.get(suite_path)
+        if suite_entry is None:
+            # the suite only carries the merged attributes, fragments are byte ranges
+            suite_entry = suites[suite_path] = {
+                'suite': TestSuite(suite_path[-1] if suite_path else ''),
+                'annotations': [], 'custom_data': [], 'test_cases': []}
+        if test_suite is not None:
+            merge_suite_attributes(suite_entry['suite'], test_suite)
+        return suite_entry
+
+    try:
+        for event, suite_path, obj in events:
+            if event == 'report':
+                shard['product_version'] = obj.product_version
+                entry(())
+            elif event == 'suite_start':
+                entry(suite_path, obj)
+            elif event == 'test_case':
+                spool.add(entry(suite_path)['test_cases'], lambda tc: spool.writer._write_test_case(tc.row()), obj)
+            elif event == 'annotation':
+                spool.add(entry(suite_path)['annotations'], lambda a: a.write_xml_stream(spool.writer), obj)
+            elif event == 'custom_data':
+                spool.add(entry(suite_path)['custom_data'], lambda d: d.write_xml_stream(spool.writer), obj)
+    finally:
+        spool.close()
+    shard['suites'] = list(suites.items())
+    return shard
+
+
+def spool_shard(source, spool_path, to_pretty=False):
+    return _spool_events(iter_report_events(source), spool_path, to_pretty)
+
+
+class _MergeNode:
+    def __init__(self, name):
+        self.suite = TestSuite(name)
+        self.children = OrderedDict()
+        self.parts = []
+
+    def get_path(self, suite_path):
+        node = self
+        for name in suite_path:
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = _MergeNode(name)
+            node = child
+        return node
+
+
+class _MergedXmlWriter(StreamingXmlWriter):
+    def __init__(self, report, root, spool_files):
+        StreamingXmlWriter.__init__(self, report)
+        self.root = root
+        self.spool_files = spool_files
+
+    def _write_document(self, out):
+        self.out = out
+        try:
+            out.write('<?xml version="1.0" encoding="utf-8"?>' + self.newl)
+            self._write_node(self.root, 'reporter', XmlWriter.reporter_attributes(self.report))
+        finally:
+            self.out = None
+
+    def _write_node(self, node, tag, attrs):
+        has_children = bool(node.children) or any(
+            suite_entry[key] for _, suite_entry in node.parts for key in ('annotations', 'custom_data', 'test_cases'))
+        self.start_element(tag, attrs, has_children)
+        if not has_children:
+            return
+
+        # same element order as StreamingXmlWriter._write_suite
+        for key in ('annotations', 'custom_data', 'test_cases'):
+            for shard_index, suite_entry in node.parts:
+                for offset, length in suite_entry[key]:
+                    self._copy(self.spool_files[shard_index], offset, length)
+
+        for child in node.children.values():
+            self._write_node(child, 'test_suite', XmlWriter.suite_attributes(child.suite))
+
+        self.end_element(tag)
+
+    def _copy(self, spool_file, offset, length):
+        spool_file.seek(offset)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while length > 0:
+            chunk = spool_file.read(min(length, COPY_CHUNK_SIZE))
+            length -= len(chunk)
+            self.out.write(decoder.decode(chunk, length <= 0))
+
+
+def write_merged_report(sources, out_file, to_pretty=False, max_workers=None):
+    # report files are parsed and serialized in worker processes into spool files,
+    # the merged document is then assembled by copying their fragments in order
+    spool_dir = tempfile.mkdtemp(prefix='testspace_merge_')
+    try:
+        shards = [None] * len(sources)
+        file_jobs = []
+        for index, source in enumerate(sources):
+            spool_path = os.path.join(spool_dir, '{0}.spool'.format(index))
+            if isinstance(source, TestSuite):
+                shards[index] = _spool_events(_iter_object_events(source), spool_path, to_pretty)
+            else:
+                file_jobs.append((index, source, spool_path))
+
+        if len(file_jobs) > 1 and max_workers != 1:
+            import concurrent.futures
+            with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+                futures = [(index, executor.submit(spool_shard, source, spool_path, to_pretty))
+                           for index, source, spool_path in file_jobs]
+                for index, future in futures:
+                    shards[index] = future.result()
+        else:
+            for index, source, spool_path in file_jobs:
+                shards[index] = spool_shard(source, spool_path, to_pretty)
+
+        report = TestspaceReport()
+        root = _MergeNode(report.name)
+        for shard_index, shard in enumerate(shards):
+            if not report.product_version:
+                report.set_product_version(shard['product_version'])
+            for suite_path, suite_entry in shard['suites']:
+                node = root.get_path(suite_path)
+                if suite_path:
+                    merge_suite_attributes(node.suite, suite_entry['suite'])
+                node.parts.append((shard_index, suite_entry))
+
+        spool_files = [io.open(shard['spool'], 'rb') for shard in shards]
+        try:
+            _MergedXmlWriter(report, root, spool_files).write(out_file, to_pretty)
+        finally:
+            for spool_file in spool_files:
+                spool_file.close()
+    finally:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Merge Testspace XML reports, combining suites with the same path.')
+    parser.add_argument('inputs', nargs='+', help='report files to merge, in order')
+    parser.add_argument('-o', '--output', required=True, help='merged report file')
+    parser.add_argument('--pretty', action='store_true', help='write indented output')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args(argv)
+    write_merged_report(args.inputs, args.output, to_pretty=args.pretty, max_workers=args.jobs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+from __future__ import absolute_import
+import gzip
+import xml.etree.ElementTree as ElementTree
+
+from .testspace_xml import Annotation, AnnotationComment, CustomData, TestCase, TestSuite, TestspaceReport, \
+    is_file_path
+
+
+def _parse_number(value):
+    if value is None:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def _make_suite(elem):
+    test_suite = TestSuite(elem.get('name'))
+    test_suite.set_description(elem.get('description', ''))
+    test_suite.set_start_time(elem.get('start_time'))
+    test_suite.set_duration(_parse_number(elem.get('duration')))
+    return test_suite
+
+
+def _make_test_case(elem):
+    test_case = TestCase(elem.get('name'), elem.get('status'))
+    test_case.set_description(elem.get('description', ''))
+    test_case.set_start_time(elem.get('start_time'))
+    test_case.set_duration(_parse_number(elem.get('duration')))
+    return test_case
+
+
+def _make_annotation(elem, load_payloads=True):
+    annotation = Annotation(elem.get('name'), elem.get('level'), elem.get('description', ''))
+    link_file = elem.get('link_file')
+    if link_file == 'true':
+        annotation.link_file = True
+        annotation.file_path = elem.get('file')
+    elif link_file == 'false':
+        annotation.file_path = elem.get('file_name')
+        annotation.mime_type = elem.get('mime_type')
+        b64_data = (elem.text or '').strip()
+        if load_payloads and b64_data:
+            # kept base64 encoded until the payload is actually needed
+            annotation.set_encoded(b64_data, elem.get('mime_type'), elem.get('file_name'))
+
+    for c_elem in elem.findall('comment'):
+        annotation.comments.append(AnnotationComment(c_elem.get('label'), c_elem.text or ''))
+    return annotation
+
+
+def _make_custom_data(elem):
+    return CustomData(elem.get('name'), elem.text or '')
+
+
+REPORT_ELEMENTS = ('test_case', 'test_suite', 'annotation', 'custom_data')
+
+
+def _iter_events(source, finished_tags=REPORT_ELEMENTS):
+    # yields (event, element, parent) and drops finished elements from the tree
+    if is_file_path(source) and source.endswith('.gz'):
+        with gzip.open(source, 'rb') as file_obj:
+            for event in _iter_events(file_obj, finished_tags):
+                yield event
+        return
+
+    stack = []
+    for event, elem in ElementTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            yield event, elem, stack[-2] if len(stack) > 1 else None
+        else:
+            stack.pop()
+            parent = stack[-1] if stack else None
+            yield event, elem, parent
+            if elem.tag in finished_tags and parent is not None:
+                parent.remove(elem)
+
+
+def iter_report_events(source, load_payloads=True):
+    # yields (event, suite name path, object) in document order:
+    #   'report'      TestspaceReport with only the reporter attributes set
+    #   'suite_start' TestSuite with its attributes set
+    #   'test_case'   complete TestCase with annotations and custom data
+    #   'annotation'  Annotation of the enclosing suite (or report)
+    #   'custom_data' CustomData of the enclosing suite (or report)
+    #   'suite_end'   the same TestSuite object as 'suite_start'
+    suites = []
+    suite_names = []
+    test_case = None
+    for event, elem, parent in _iter_events(source):
+        tag = elem.tag
+        if event == 'start':
+            if tag == 'reporter':
+                report = TestspaceReport()
+                report.set_product_version(elem.get('product_version'))
+                yield 'report', (), report
+            elif tag == 'test_suite':
+                test_suite = _make_suite(elem)
+                suites.append(test_suite)
+                suite_names.append(test_suite.name)
+                yield 'suite_start', tuple(suite_names), test_suite
+            elif tag == 'test_case':
+                test_case = _make_test_case(elem)
+            continue
+
+        if tag == 'test_suite':
+            yield 'suite_end', tuple(suite_names), suites.pop()
+            suite_names.pop()
+        elif tag == 'test_case':
+            yield 'test_case', tuple(suite_names), test_case
+            test_case = None
+        elif tag == 'annotation':
+            if parent.tag == 'test_case':
+                test_case.add_annotation(_make_annotation(elem, load_payloads))
+            else:
+                yield 'annotation', tuple(suite_names), _make_annotation(elem, load_payloads)
+        elif tag == 'custom_data':
+            if parent.tag == 'test_case':
+                test_case.custom_data.append(_make_custom_data(elem))
+            else:
+                yield 'custom_data', tuple(suite_names), _make_custom_data(elem)
+
+
+def load_report(source, load_payloads=True):
+    report = None
+    suites = []
+    for event, suite_path, obj in iter_report_events(source, load_payloads):
+        if event == 'report':
+            report = obj
+            suites.append(report)
+        elif event == 'suite_start':
+            suites.append(suites[-1].add_test_suite(obj))
+        elif event == 'suite_end':
+            suites.pop()
+        elif event == 'test_case':
+            suites[-1].add_test_case(obj)
+        elif event == 'annotation':
+            suites[-1].add_annotation(obj)
+        elif event == 'custom_data':
+            suites[-1].custom_data.append(obj)
+    return report
+
+
+def iter_test_cases(source, load_payloads=True):
+    # yields (suite name path, TestCase) one at a time without building the report
+    for event, suite_path, obj in iter_report_events(source, load_payloads):
+        if event == 'test_case':
+            yield suite_path, obj
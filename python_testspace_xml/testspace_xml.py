@@ -1,53 +1,704 @@
 from __future__ import print_function
 import base64
 import gzip
+import hashlib
+import json
 import os
 import os.path
 import io
-from io import BytesIO
 import re
+import struct
 import sys
+import tempfile
+import time
+import zlib
+from array import array
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from xml.dom.minidom import parseString
 
+try:
+    import mmap
+except ImportError:
+    mmap = None
+
+
+# http://stackoverflow.com/questions/1707890/fast-way-to-filter-illegal-xml-unicode-chars-in-python
+_illegal_unichrs = [
+    (0x00, 0x08), (0x0B, 0x1F), (0x7F, 0x84), (0x86, 0x9F),
+    (0xD800, 0xDFFF), (0xFDD0, 0xFDDF), (0xFFFE, 0xFFFF),
+    (0x1FFFE, 0x1FFFF), (0x2FFFE, 0x2FFFF), (0x3FFFE, 0x3FFFF),
+    (0x4FFFE, 0x4FFFF), (0x5FFFE, 0x5FFFF), (0x6FFFE, 0x6FFFF),
+    (0x7FFFE, 0x7FFFF), (0x8FFFE, 0x8FFFF), (0x9FFFE, 0x9FFFF),
+    (0xAFFFE, 0xAFFFF), (0xBFFFE, 0xBFFFF), (0xCFFFE, 0xCFFFF),
+    (0xDFFFE, 0xDFFFF), (0xEFFFE, 0xEFFFF), (0xFFFFE, 0xFFFFF),
+    (0x10FFFE, 0x10FFFF)]
+
+if sys.version_info > (3,0):
+    _illegal_ranges = ['%s-%s' % (chr(low), chr(high))
+                       for (low, high) in _illegal_unichrs
+                       if low < sys.maxunicode]
+    _illegal_xml_re = re.compile('[%s]' % ''.join(_illegal_ranges))
+else:
+    _illegal_ranges = [u'%s-%s' % (unichr(low), unichr(high))
+                       for (low, high) in _illegal_unichrs
+                       if low < sys.maxunicode]
+    _illegal_xml_re = re.compile(u'[%s]' % u''.join(_illegal_ranges))
+
+
+class XmlSanitizer:
+    def __init__(self, max_cache_size=4096, max_cached_length=256):
+        self.max_cache_size = max_cache_size
+        self.max_cached_length = max_cached_length
+        self.cache = OrderedDict()
+        self.calls = 0
+        self.fast_path = 0
+        self.cache_hits = 0
+        self.changed = 0
+
+    def clean(self, string_to_clean):
+        self.calls += 1
+        # printable ASCII can't contain any of the illegal ranges
+        if hasattr(string_to_clean, 'isascii') and string_to_clean.isascii() and string_to_clean.isprintable():
+            self.fast_path += 1
+            return string_to_clean
+
+        cache = self.cache
+        cleaned = cache.get(string_to_clean)
+        if cleaned is not None:
+            self.cache_hits += 1
+            # keep most recently used entries at the end; pop() as another thread
+            # may have refreshed or evicted the entry in the meantime
+            cache.pop(string_to_clean, None)
+            cache[string_to_clean] = cleaned
+            return cleaned
+
+        cleaned = _illegal_xml_re.sub('', string_to_clean)
+        if len(cleaned) != len(string_to_clean):
+            self.changed += 1
+
+        if len(string_to_clean) <= self.max_cached_length and self.max_cache_size > 0:
+            cache[string_to_clean] = cleaned
+            if len(cache) > self.max_cache_size:
+                try:
+                    cache.popitem(last=False)
+                except KeyError:
+                    pass
+        return cleaned
+
+    def clear(self):
+        self.cache.clear()
+        self.calls = self.fast_path = self.cache_hits = self.changed = 0
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'fast_path': self.fast_path,
+            'cache_hits': self.cache_hits,
+            'changed': self.changed,
+            'cache_size': len(self.cache),
+        }
+
+
+sanitizer = XmlSanitizer()
+
+ANNOTATION_CHUNK_SIZE = 64 * 1024
+FILE_CHUNK_SIZE = 1024 * 1024
+# files of at least this size are memory mapped instead of read
+MMAP_MIN_SIZE = 1024 * 1024
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+class _Phase(object):
+    __slots__ = ('stats', 'name')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.stats.push(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.pop()
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_no_phase = _NoPhase()
+
+
+class WriteStats:
+    # timings are exclusive: time spent in a nested phase (e.g. sanitize inside
+    # serialization) is only counted for the nested phase
+    active = None
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.timings = {}
+        self.counts = {}
+        self.total_seconds = 0
+        self.peak_traced_bytes = None
+        self.peak_rss_bytes = None
+        self._stack = []
+        self._started = None
+
+    def push(self, phase):
+        now = _clock()
+        if self._stack:
+            top = self._stack[-1]
+            self.timings[top] = self.timings.get(top, 0) + now - self._started
+        self._stack.append(phase)
+        self._started = now
+
+    def pop(self):
+        now = _clock()
+        phase = self._stack.pop()
+        self.timings[phase] = self.timings.get(phase, 0) + now - self._started
+        self._started = now
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def count(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @contextmanager
+    def collect(self):
+        if WriteStats.active is self:
+            yield self
+            return
+
+        previous = WriteStats.active
+        tracemalloc = None
+        if self.trace_memory:
+            import tracemalloc
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        WriteStats.active = self
+        started = _clock()
+        try:
+            yield self
+        finally:
+            WriteStats.active = previous
+            self.total_seconds += _clock() - started
+            if tracemalloc is not None:
+                self.peak_traced_bytes = max(self.peak_traced_bytes or 0, tracemalloc.get_traced_memory()[1])
+                if not tracing:
+                    tracemalloc.stop()
+            try:
+                import resource
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                self.peak_rss_bytes = rss if sys.platform == 'darwin' else rss * 1024
+            except ImportError:
+                pass
+
+    def as_dict(self):
+        timings = dict(self.timings)
+        timings['other'] = max(0, self.total_seconds - sum(self.timings.values()))
+        return {
+            'total_seconds': self.total_seconds,
+            'phase_seconds': timings,
+            'counts': dict(self.counts),
+            'peak_traced_bytes': self.peak_traced_bytes,
+            'peak_rss_bytes': self.peak_rss_bytes,
+        }
+
+
+def collect_stats(stats):
+    return _no_phase if stats is None else stats.collect()
+
+
+def stats_phase(name):
+    stats = WriteStats.active
+    return _no_phase if stats is None else _Phase(stats, name)
+
+
+def stats_count(name, value=1):
+    stats = WriteStats.active
+    if stats is not None:
+        stats.count(name, value)
+
+
+class _TimedFile:
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+
+    def write(self, data):
+        with stats_phase('io'):
+            self.file_obj.write(data)
+
+
+@contextmanager
+def map_file(file_obj):
+    # read-only memoryview of a large file, None for small files or where mapping
+    # isn't possible; slices of it must not outlive the with block
+    mapped = view = None
+    if mmap is not None and os.fstat(file_obj.fileno()).st_size >= MMAP_MIN_SIZE:
+        try:
+            mapped = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+        except (EnvironmentError, ValueError):
+            mapped = None
+    try:
+        yield view
+    finally:
+        if view is not None:
+            view.release()
+        if mapped is not None:
+            mapped.close()
+
+
+def as_buffer(data):
+    # bytes are kept as they are and other buffer objects (bytearray, memoryview,
+    # mmap, array) are referenced through a memoryview instead of being copied
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, type(u'')):
+        return data.encode('utf-8')
+    view = memoryview(data)
+    if not view.c_contiguous:
+        return view.tobytes()
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast('B')
+    return view
+
+
+def iter_gzip_file(file_path, chunk_size=FILE_CHUNK_SIZE, compresslevel=9):
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with io.open(file_path, 'rb') as in_file_obj, map_file(in_file_obj) as view:
+        if view is not None:
+            for offset in range(0, len(view), chunk_size):
+                with stats_phase('gzip'):
+                    compressed = compressor.compress(view[offset:offset + chunk_size])
+                if compressed:
+                    yield compressed
+        else:
+            while True:
+                with stats_phase('io'):
+                    chunk = in_file_obj.read(chunk_size)
+                if not chunk:
+                    break
+                with stats_phase('gzip'):
+                    compressed = compressor.compress(chunk)
+                if compressed:
+                    yield compressed
+    with stats_phase('gzip'):
+        compressed = compressor.flush()
+    yield compressed
+
+
+def gzip_file(file_path, compresslevel=9):
+    if payload_cache is not None:
+        return b''.join(payload_cache.iter_gzip_file(file_path, compresslevel))
+    return b''.join(iter_gzip_file(file_path, compresslevel=compresslevel))
+
+
+def file_digest(file_path):
+    digest = hashlib.sha1()
+    with io.open(file_path, 'rb') as in_file_obj, map_file(in_file_obj) as view:
+        if view is not None:
+            digest.update(view)
+        else:
+            for chunk in iter(lambda: in_file_obj.read(FILE_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_gzip_file(file_path):
+    with io.open(file_path, 'rb') as in_file_obj:
+        return in_file_obj.read(2) == b'\x1f\x8b'
+
+
+def iter_file(file_path, chunk_size=FILE_CHUNK_SIZE):
+    with io.open(file_path, 'rb') as in_file_obj:
+        while True:
+            with stats_phase('io'):
+                chunk = in_file_obj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def gzip_size(file_path):
+    # uncompressed size from the gzip trailer; for files of several gzip members
+    # it is the size of the last one, and it wraps around at 4 GiB
+    with io.open(file_path, 'rb') as in_file_obj:
+        in_file_obj.seek(0, os.SEEK_END)
+        if in_file_obj.tell() < 18:
+            return 0
+        in_file_obj.seek(-4, os.SEEK_END)
+        return struct.unpack('<I', in_file_obj.read(4))[0]
+
+
+def gzip_bytes(data, compresslevel=9):
+    with stats_phase('gzip'):
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+
+class PayloadCache:
+    # gzipped file payloads kept on disk across runs. A payload is found through the
+    # file's path, size and mtime, or by its content hash when only those changed;
+    # the least recently used payloads are removed beyond max_bytes
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.payload_dir = os.path.join(cache_dir, 'payloads')
+        self.key_dir = os.path.join(cache_dir, 'keys')
+        for path in (self.payload_dir, self.key_dir):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        # payload name -> size, least recently used first, read on first use
+        self.entries = None
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load_entries(self):
+        if self.entries is None:
+            entries = []
+            for name in os.listdir(self.payload_dir):
+                if name.endswith('.gz'):
+                    stat = os.stat(os.path.join(self.payload_dir, name))
+                    entries.append((stat.st_mtime, name, stat.st_size))
+            self.entries = OrderedDict((name, size) for _, name, size in sorted(entries))
+            self.total_bytes = sum(self.entries.values())
+        return self.entries
+
+    @staticmethod
+    def stat_key(file_path, compresslevel):
+        stat = os.stat(file_path)
+        key = u'{0}\0{1}\0{2!r}\0{3}'.format(os.path.abspath(file_path), stat.st_size, stat.st_mtime, compresslevel)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def lookup(self, file_path, compresslevel=9):
+        # returns the cached payload path (or None) and the payload name
+        key_path = os.path.join(self.key_dir, self.stat_key(file_path, compresslevel))
+        name = None
+        if os.path.isfile(key_path):
+            with io.open(key_path, 'r') as key_file_obj:
+                name = key_file_obj.read().strip() or None
+        if name is None or not os.path.isfile(os.path.join(self.payload_dir, name)):
+            name = '{0}-{1}.gz'.format(file_digest(file_path), compresslevel)
+            self._write_atomic(key_path, name.encode())
+
+        entry = os.path.join(self.payload_dir, name)
+        if not os.path.isfile(entry):
+            self.misses += 1
+            return None, name
+        self.hits += 1
+        entries = self._load_entries()
+        entries[name] = entries.pop(name, os.path.getsize(entry))
+        try:
+            os.utime(entry, None)
+        except EnvironmentError:
+            pass
+        return entry, name
+
+    def iter_gzip_file(self, file_path, compresslevel=9):
+        entry, name = self.lookup(file_path, compresslevel)
+        in_file_obj = None
+        if entry is not None:
+            try:
+                in_file_obj = io.open(entry, 'rb')
+            except EnvironmentError:
+                # removed by another process in the meantime
+                pass
+        if in_file_obj is not None:
+            with in_file_obj:
+                while True:
+                    with stats_phase('io'):
+                        chunk = in_file_obj.read(FILE_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield chunk
+            return
+
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.payload_dir)
+        try:
+            with io.open(fd, 'wb') as out_file_obj:
+                for chunk in iter_gzip_file(file_path, compresslevel=compresslevel):
+                    with stats_phase('io'):
+                        out_file_obj.write(chunk)
+                    yield chunk
+            self._store(tmp_path, name)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _write_atomic(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with io.open(fd, 'wb') as out_file_obj:
+            out_file_obj.write(data)
+        self._replace(tmp_path, path)
+
+    @staticmethod
+    def _replace(src, dst):
+        try:
+            getattr(os, 'replace', os.rename)(src, dst)
+        except EnvironmentError:
+            # another process stored it first
+            os.remove(src)
+
+    def _store(self, tmp_path, name):
+        size = os.path.getsize(tmp_path)
+        self._replace(tmp_path, os.path.join(self.payload_dir, name))
+        entries = self._load_entries()
+        self.total_bytes += size - entries.pop(name, 0)
+        entries[name] = size
+        self.evict()
+
+    def evict(self):
+        entries = self._load_entries()
+        evicted = set()
+        while entries and self.total_bytes > self.max_bytes:
+            name, size = entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.payload_dir, name))
+            except EnvironmentError:
+                pass
+            evicted.add(name)
+        if not evicted:
+            return
+        self.evictions += len(evicted)
+        # drop the keys that pointed to removed payloads
+        for key in os.listdir(self.key_dir):
+            key_path = os.path.join(self.key_dir, key)
+            try:
+                with io.open(key_path, 'r') as key_file_obj:
+                    if key_file_obj.read().strip() in evicted:
+                        os.remove(key_path)
+            except EnvironmentError:
+                pass
+
+    def clear(self):
+        for directory in (self.payload_dir, self.key_dir):
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        entries = self._load_entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': self.total_bytes,
+        }
+
+
+payload_cache = None
+
+
+def set_payload_cache(cache_dir, max_bytes=1024 * 1024 * 1024):
+    # file annotations are compressed through the cache from now on, None disables it
+    global payload_cache
+    payload_cache = PayloadCache(cache_dir, max_bytes) if cache_dir else None
+    return payload_cache
+
+
+def iter_base64(byte_chunks, chunk_size=ANNOTATION_CHUNK_SIZE):
+    # base64 output can only be concatenated at 3 byte input boundaries
+    chunk_size -= chunk_size % 3
+    pending = b''
+    for chunk in byte_chunks:
+        stats_count('annotation_compressed_bytes', len(chunk))
+        data = pending + chunk if pending else chunk
+        usable = len(data) - len(data) % 3
+        for offset in range(0, usable, chunk_size):
+            with stats_phase('base64'):
+                encoded = base64.b64encode(data[offset:min(offset + chunk_size, usable)]).decode()
+            stats_count('annotation_encoded_bytes', len(encoded))
+            yield encoded
+        pending = data[usable:]
+    if pending:
+        with stats_phase('base64'):
+            encoded = base64.b64encode(pending).decode()
+        stats_count('annotation_encoded_bytes', len(encoded))
+        yield encoded
+
+
+def is_file_path(out_file):
+    return isinstance(out_file, str) or (sys.version_info < (3,0) and isinstance(out_file, unicode))
+
+
+@contextmanager
+def open_output(out_file, compress=None, compresslevel=9):
+    # compress=None gzips paths ending in .gz; streams must be binary when compressing
+    if not out_file:
+        out_file = sys.stdout
+
+    is_path = is_file_path(out_file)
+    if compress is None:
+        compress = is_path and out_file.endswith('.gz')
+
+    if compress:
+        if is_path:
+            gzip_obj = gzip.GzipFile(out_file, 'wb', compresslevel)
+        else:
+            gzip_obj = gzip.GzipFile(fileobj=out_file, mode='wb', compresslevel=compresslevel)
+        # closing the wrapper finishes the gzip stream but leaves a caller's stream open
+        with io.TextIOWrapper(gzip_obj, encoding='utf-8') as file_obj:
+            yield _timed(file_obj)
+    elif is_path:
+        file_attrs = {}
+        if sys.version_info > (3,0):
+            file_attrs = {'encoding': 'utf-8'}
+        with open(out_file, 'w', **file_attrs) as file_obj:
+            yield _timed(file_obj)
+    else:
+        yield _timed(out_file)
+
+
+def _timed(file_obj):
+    return file_obj if WriteStats.active is None else _TimedFile(file_obj)
+
+
+class CustomData(object):
+    __slots__ = ('name', 'value')
 
-class CustomData:
     def __init__(self, name, value):
         self.name = name
         self.value = value
 
     def write_xml(self, parent_element, dom):
+        stats_count('custom_data')
         d_elem = dom.createElement('custom_data')
         d_elem.setAttribute('name', XmlWriter.invalid_xml_remove(self.name))
         cdata = dom.createCDATASection(self.value)
         d_elem.appendChild(cdata)
         parent_element.appendChild(d_elem)
 
+    def write_xml_stream(self, writer):
+        stats_count('custom_data')
+        writer.write_cdata_element(
+            'custom_data', [('name', XmlWriter.invalid_xml_remove(self.name))], self.value)
+
+
+class AnnotationComment(object):
+    __slots__ = ('name', 'comment')
 
-class AnnotationComment:
     def __init__(self, name, comment):
         self.name = name
         self.comment = comment
 
 
-class Annotation:
-    def __init__(self, name='unknown', level='info', description=''):
-        self.name = name
-        self.level = level
-        self.description = description
+class AnnotationPayload(object):
+    # the file, buffer or link of an annotation and its compression state, only
+    # created once an annotation has one so text annotations stay small
+    __slots__ = ('mime_type', 'file_path', 'link_file', 'gzip_data', 'b64_data', 'gzip_future', 'raw_bytes',
+                 'source_path', 'lazy_file', 'gzipped_file', 'buffer', 'payload_source', 'shared_payload',
+                 'payload_key', 'compresslevel', 'compression_window')
+
+    def __init__(self):
         self.mime_type = None
         self.file_path = None
         self.link_file = False
         self.gzip_data = None
-        self.comments = []
+        self.b64_data = None
+        self.gzip_future = None
+        self.raw_bytes = 0
+        self.source_path = None
+        self.lazy_file = False
+        # the file at source_path is gzip compressed already
+        self.gzipped_file = False
+        self.buffer = None
+        self.payload_source = None
+        self.shared_payload = False
+        # the PayloadIndex key this annotation was indexed under
+        self.payload_key = None
+        self.compresslevel = 9
+        # the CompressionWindow this annotation's gzip_future belongs to
+        self.compression_window = None
+
+
+def _payload_property(field, default=None):
+    def getter(self):
+        payload = self._payload
+        return default if payload is None else getattr(payload, field)
+
+    def setter(self, value):
+        payload = self._payload
+        if payload is None:
+            if value is default or (type(value) is int and value == default):
+                return
+            payload = self._payload = AnnotationPayload()
+        setattr(payload, field, value)
+
+    return property(getter, setter)
+
+
+class Annotation(object):
+    __slots__ = ('name', 'level', 'description', '_payload', '_comments')
+
+    def __init__(self, name='unknown', level='info', description=''):
+        self.name = name
+        self.level = level
+        self.description = description
+        self._payload = None
+        self._comments = None
+
+    mime_type = _payload_property('mime_type')
+    file_path = _payload_property('file_path')
+    link_file = _payload_property('link_file', False)
+    gzip_data = _payload_property('gzip_data')
+    b64_data = _payload_property('b64_data')
+    gzip_future = _payload_property('gzip_future')
+    raw_bytes = _payload_property('raw_bytes', 0)
+    source_path = _payload_property('source_path')
+    lazy_file = _payload_property('lazy_file', False)
+    gzipped_file = _payload_property('gzipped_file', False)
+    buffer = _payload_property('buffer')
+    payload_source = _payload_property('payload_source')
+    shared_payload = _payload_property('shared_payload', False)
+    payload_key = _payload_property('payload_key')
+    compresslevel = _payload_property('compresslevel', 9)
+    compression_window = _payload_property('compression_window')
+
+    @property
+    def comments(self):
+        # most annotations never get comments, so the list is created on first use
+        if self._comments is None:
+            self._comments = []
+        return self._comments
+
+    @comments.setter
+    def comments(self, comments):
+        self._comments = comments
 
     def add_comment(self, name, comment):
         comment = AnnotationComment(name, comment)
         self.comments.append(comment)
 
-    def set_file(self, file_path, mime_type='octet/stream'):
-        self.link_file = False
+    def set_file(self, file_path, mime_type='octet/stream', lazy=False, compresslevel=9, gzipped=False,
+                 payload_index=None, payload_budget=None, compression_executor=None):
+        # gzipped=True: the file is gzip compressed already and its decompressed
+        # content is the payload, it is embedded as it is; with a payload_index, a
+        # payload identical to an indexed one is shared instead of compressed again;
+        # a payload_budget's per-annotation cap is applied before either; with a
+        # compression_executor the file is compressed there instead of on this thread
+        self._reset_data()
         self.file_path = file_path
         self.mime_type = mime_type
+        self.compresslevel = compresslevel
         if file_path:
             if not os.path.isfile(self.file_path):
                 self.level = 'error'
@@ -55,24 +706,68 @@ class Annotation:
                 self.file_path = None
                 return
 
-            with io.open(self.file_path, 'rb') as in_file_obj:
-                out = BytesIO()
-                with gzip.GzipFile(fileobj=out, mode='wb') as out_file_obj:
-                    out_file_obj.writelines(in_file_obj)
-                self.gzip_data = out.getvalue()
+            self.raw_bytes = os.path.getsize(self.file_path)
+            self.source_path = self.file_path
+            if gzipped and is_gzip_file(self.file_path):
+                self.gzipped_file = True
+                self.raw_bytes = gzip_size(self.file_path)
+                if self.file_path.endswith('.gz'):
+                    self.file_path = self.file_path[:-3]
+
+            # compressed (unless gzipped) and encoded in chunks when the report is written
+            self.lazy_file = True
+            if payload_budget is not None:
+                payload_budget.limit_added(self)
+            if payload_index is not None:
+                payload_index.add(self)
+            if lazy or not (self.lazy_file or self.buffer is not None):
+                # lazy, sharing the payload of an identical annotation, or linked or removed by the budget
+                return
 
-    def set_buffer(self, buffer, mime_type='octet/stream', file_name=None):
-        self.link_file = False
+            if compression_executor is not None and self.is_pending():
+                self.compress_async(compression_executor)
+            else:
+                self.resolve()
+
+    def set_buffer(self, buffer, mime_type='octet/stream', file_name=None, lazy=False, compresslevel=9,
+                   payload_index=None, payload_budget=None, compression_executor=None):
+        # text is utf-8 encoded, bytes-like objects are not copied; with lazy=True
+        # they must stay unchanged (and an mmap open) until the report is written
+        buffer = as_buffer(buffer)
+        self._reset_data()
         self.file_path = file_name
         self.mime_type = mime_type
-        out = BytesIO()
-        with gzip.GzipFile(fileobj=out, mode='wb') as out_file_obj:
-            out_file_obj.write(buffer)
-        self.gzip_data = out.getvalue()
+        self.compresslevel = compresslevel
+        self.raw_bytes = len(buffer)
+        # kept uncompressed until compress_async() or write time
+        self.buffer = buffer
+        if payload_budget is not None:
+            payload_budget.limit_added(self)
+        if payload_index is not None:
+            payload_index.add(self)
+        if lazy or self.buffer is None:
+            # lazy, sharing the payload of an identical annotation, or linked or removed by the budget
+            return
+
+        if compression_executor is not None:
+            if not isinstance(self.buffer, bytes):
+                # not lazy, so the caller may change the buffer once this returns
+                self.buffer = self.buffer.tobytes()
+            self.compress_async(compression_executor)
+            return
+        self.gzip_data = gzip_bytes(self.buffer, compresslevel)
+        self.buffer = None
+
+    def set_encoded(self, b64_data, mime_type='octet/stream', file_name=None):
+        # payload as found in a report: base64 of gzip data, decoded only on demand
+        self._reset_data()
+        self.file_path = file_name
+        self.mime_type = mime_type
+        self.b64_data = b64_data
 
     def set_link(self, url):
+        self._reset_data()
         self.link_file = True
-        self.gzip_data = None
         self.mime_type = None
         if re.match(r'^(https?|file)://', url):
             self.file_path = url
@@ -90,28 +785,240 @@ class Annotation:
 
         self.file_path = 'file:{0}{1}'.format(prefix, url)
 
-    def write_xml(self, parent_element, dom):
-        annotation = dom.createElement('annotation')
-        annotation.setAttribute('name', XmlWriter.invalid_xml_remove(self.name))
-        annotation.setAttribute('level', self.level)
+    def _reset_data(self):
+        self.link_file = False
+        self.lazy_file = False
+        self.gzipped_file = False
+        self.gzip_data = None
+        self.b64_data = None
+        self.gzip_future = None
+        self.raw_bytes = 0
+        self.source_path = None
+        self.buffer = None
+        self.payload_source = None
+        self.shared_payload = False
+        self.payload_key = None
+        self._release_window()
+
+    def has_data(self):
+        if self._payload is None:
+            return False
+        return bool(self.gzip_data) or self.lazy_file or self.buffer is not None or \
+            self.gzip_future is not None or self.payload_source is not None or bool(self.b64_data)
+
+    def is_pending(self):
+        # gzipped files need no compression
+        if self._payload is None:
+            return False
+        return self.gzip_future is None and \
+            ((self.lazy_file and not self.gzipped_file) or self.buffer is not None or self.payload_source is not None)
+
+    def share_payload(self, source):
+        # reuse the compressed payload of an annotation with identical content
+        self.lazy_file = False
+        self.buffer = None
+        self.gzip_data = source.gzip_data
+        self.b64_data = source.b64_data
+        if not source.b64_data:
+            source.shared_payload = True
+            self.payload_source = source
+
+    def compress_async(self, executor, compresslevel=None):
+        if compresslevel is None:
+            compresslevel = self.compresslevel
+        self.compresslevel = compresslevel
+        if self.gzip_future is not None:
+            return self.gzip_future
+        if self.payload_source is not None:
+            self.gzip_future = self.payload_source.compress_async(executor, compresslevel)
+            self.payload_source = None
+        elif self.lazy_file and not self.gzipped_file:
+            self.gzip_future = executor.submit(gzip_file, self.file_path, compresslevel)
+        elif self.buffer is not None:
+            buffer = self.buffer
+            if isinstance(buffer, memoryview) and _is_process_executor(executor):
+                # memoryviews can't be pickled
+                buffer = buffer.tobytes()
+            self.gzip_future = executor.submit(gzip_bytes, buffer, compresslevel)
+            self.buffer = None
+        return self.gzip_future
+
+    def resolve(self):
+        if self.gzip_future is not None:
+            with stats_phase('gzip'):
+                self.gzip_data = self.gzip_future.result()
+            self.gzip_future = None
+            self.lazy_file = False
+            self._release_window()
+        elif self.payload_source is not None:
+            self.gzip_data = self.payload_source.resolve()
+            self.payload_source = None
+        elif self.buffer is not None:
+            self.gzip_data = gzip_bytes(self.buffer, self.compresslevel)
+            self.buffer = None
+        elif self.lazy_file:
+            if self.gzipped_file:
+                self.gzip_data = b''.join(iter_file(self.source_path))
+            else:
+                self.gzip_data = gzip_file(self.file_path, self.compresslevel)
+            self.lazy_file = False
+        elif self.b64_data:
+            self.gzip_data = base64.b64decode(self.b64_data)
+            self.b64_data = None
+        return self.gzip_data
+
+    def _release_window(self):
+        window = self.compression_window
+        if window is not None:
+            self.compression_window = None
+            window.release()
+
+    def read_payload(self):
+        gzip_data = self.resolve()
+        if not gzip_data:
+            return None
+        return zlib.decompress(gzip_data, 16 + zlib.MAX_WBITS)
+
+    def content_key(self):
+        if self.payload_source is not None or self.gzip_future is not None:
+            return None
+        if self.buffer is not None:
+            return 'raw', hashlib.sha1(self.buffer).hexdigest(), self.compresslevel
+        if self.lazy_file and self.gzipped_file:
+            return 'gzip', file_digest(self.source_path)
+        if self.lazy_file:
+            return 'raw', file_digest(self.file_path), self.compresslevel
+        if self.gzip_data:
+            return 'gzip', hashlib.sha1(self.gzip_data).hexdigest()
+        if self.b64_data:
+            return 'b64', hashlib.sha1(self.b64_data.encode()).hexdigest()
+        return None
+
+    def raw_size(self):
+        if self.buffer is not None:
+            return len(self.buffer)
+        if self.lazy_file:
+            return self.raw_bytes if self.gzipped_file else os.path.getsize(self.file_path)
+        return 0
+
+    def payload_size(self):
+        # uncompressed size where known, otherwise the size of the compressed payload
+        if self.raw_bytes:
+            return self.raw_bytes
+        if self.b64_data:
+            return len(self.b64_data) * 3 // 4
+        if self.gzip_data:
+            return len(self.gzip_data)
+        return self.raw_size()
+
+    def iter_raw_chunks(self, chunk_size=ANNOTATION_CHUNK_SIZE):
+        if self.buffer is not None:
+            for offset in range(0, len(self.buffer), chunk_size):
+                yield self.buffer[offset:offset + chunk_size]
+            return
+        if self.lazy_file and self.gzip_future is None and not self.gzipped_file:
+            with io.open(self.file_path, 'rb') as in_file_obj:
+                for chunk in iter(lambda: in_file_obj.read(chunk_size), b''):
+                    yield chunk
+            return
+
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for gzip_data in self.iter_gzip_chunks():
+            for offset in range(0, len(gzip_data), chunk_size):
+                data = gzip_data[offset:offset + chunk_size]
+                while data:
+                    # bounded output, a small compressed chunk can expand a lot
+                    chunk = decompressor.decompress(data, chunk_size)
+                    if chunk:
+                        yield chunk
+                    data = decompressor.unconsumed_tail
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
+
+    def read_head_tail(self, head_bytes, tail_bytes):
+        if self.buffer is not None:
+            tail = self.buffer[len(self.buffer) - tail_bytes:] if tail_bytes else b''
+            return bytes(self.buffer[:head_bytes]), bytes(tail)
+        if self.lazy_file and self.gzip_future is None and not self.gzipped_file:
+            size = os.path.getsize(self.file_path)
+            with io.open(self.file_path, 'rb') as in_file_obj:
+                head = in_file_obj.read(head_bytes)
+                in_file_obj.seek(max(head_bytes, size - tail_bytes))
+                return head, in_file_obj.read(tail_bytes) if tail_bytes else b''
+
+        head, tail = b'', b''
+        for chunk in self.iter_raw_chunks():
+            if len(head) < head_bytes:
+                used = head_bytes - len(head)
+                head += chunk[:used]
+                chunk = chunk[used:]
+            if tail_bytes and chunk:
+                tail = (tail + chunk)[-tail_bytes:]
+        return head, tail
+
+    def estimated_size(self):
+        # upper bound of the serialized size, without compressing anything
+        size = 100 + len(self.name or '') + len(self.description or '')
+        if self.b64_data:
+            size += len(self.b64_data)
+        elif self.gzip_data:
+            size += len(self.gzip_data) * 4 // 3 + 4
+        elif self.payload_source is not None:
+            size += self.payload_source.estimated_size()
+        elif self.lazy_file and self.gzipped_file:
+            size += os.path.getsize(self.source_path) * 4 // 3 + 4
+        else:
+            size += self.raw_size() * 4 // 3 + 4
+        for comment in self._comments or ():
+            size += 40 + len(comment.name or '') + len(comment.comment or '')
+        return size
+
+    def iter_gzip_chunks(self):
+        if self.lazy_file and self.gzip_future is None and not self.shared_payload:
+            if self.gzipped_file:
+                return iter_file(self.source_path)
+            if payload_cache is not None:
+                return payload_cache.iter_gzip_file(self.file_path, self.compresslevel)
+            return iter_gzip_file(self.file_path, compresslevel=self.compresslevel)
+        self.resolve()
+        return iter([self.gzip_data] if self.gzip_data else [])
+
+    def iter_base64_chunks(self):
+        stats_count('annotation_raw_bytes', self.raw_bytes)
+        if self.b64_data:
+            stats_count('annotation_encoded_bytes', len(self.b64_data))
+            return iter([self.b64_data])
+        return iter_base64(self.iter_gzip_chunks())
+
+    def xml_attributes(self):
+        attrs = [('name', XmlWriter.invalid_xml_remove(self.name)), ('level', self.level)]
         if self.description:
-            annotation.setAttribute('description', XmlWriter.invalid_xml_remove(self.description))
+            attrs.append(('description', XmlWriter.invalid_xml_remove(self.description)))
 
-        if self.gzip_data:
-            annotation.setAttribute('link_file', 'false')
+        if self.has_data():
+            attrs.append(('link_file', 'false'))
             if self.file_path:
-                annotation.setAttribute('file_name', os.path.basename(self.file_path))
-            annotation.setAttribute('mime_type', self.mime_type)
-            b64_data = base64.b64encode(self.gzip_data)
-            b64_data_string = b64_data.decode()
+                attrs.append(('file_name', os.path.basename(self.file_path)))
+            attrs.append(('mime_type', self.mime_type))
+        elif self.link_file and self.file_path:
+            attrs.append(('link_file', 'true'))
+            attrs.append(('file', self.file_path))
+        return attrs
+
+    def write_xml(self, parent_element, dom):
+        stats_count('annotations')
+        annotation = dom.createElement('annotation')
+        for attr_name, attr_value in self.xml_attributes():
+            annotation.setAttribute(attr_name, attr_value)
+
+        if self.has_data():
+            b64_data_string = ''.join(self.iter_base64_chunks())
             cdata = dom.createCDATASection(b64_data_string)
             annotation.appendChild(cdata)
-        elif self.link_file and self.file_path:
-            annotation.setAttribute('link_file', 'true')
-            annotation.setAttribute('file', self.file_path)
 
         # add comments
-        for comment in self.comments:
+        for comment in self._comments or ():
             c_elem = dom.createElement('comment')
             c_elem.setAttribute('label', XmlWriter.invalid_xml_remove(comment.name))
             cdata = dom.createCDATASection(comment.comment)
@@ -120,16 +1027,336 @@ class Annotation:
 
         parent_element.appendChild(annotation)
 
+    def write_xml_stream(self, writer):
+        stats_count('annotations')
+        attrs = self.xml_attributes()
+        has_data = self.has_data()
+        comments = self._comments or ()
+        if has_data and not comments:
+            writer.write_cdata_chunks_element('annotation', attrs, self.iter_base64_chunks())
+            return
+
+        has_children = has_data or bool(comments)
+        writer.start_element('annotation', attrs, has_children)
+        if has_data:
+            writer.write_cdata_chunks(self.iter_base64_chunks())
+        for comment in comments:
+            writer.write_cdata_element(
+                'comment', [('label', XmlWriter.invalid_xml_remove(comment.name))], comment.comment)
+        if has_children:
+            writer.end_element('annotation')
+
+
+def _is_process_executor(executor):
+    import concurrent.futures
+    return isinstance(executor, concurrent.futures.ProcessPoolExecutor)
+
+
+class CompressionWindow:
+    # compresses the pending payloads of annotations in document order with at
+    # most size of them submitted ahead of the writer; each one the writer
+    # resolves makes room for the next, so finished payloads don't pile up
+    def __init__(self, executor, annotations, size=None, compresslevel=9):
+        self.executor = executor
+        self.annotations = iter(annotations)
+        self.size = size
+        self.compresslevel = compresslevel
+        self.in_flight = 0
+
+    def fill(self):
+        submitted = 0
+        while self.size is None or self.in_flight < self.size:
+            a = next(self.annotations, None)
+            if a is None:
+                break
+            # shared payloads are compressed through their source
+            if not a.is_pending() or a.payload_source is not None:
+                continue
+            a.compress_async(self.executor, self.compresslevel)
+            a.compression_window = self
+            self.in_flight += 1
+            submitted += 1
+        return submitted
+
+    def release(self):
+        self.in_flight -= 1
+        self.fill()
+
+
+class PayloadIndex:
+    def __init__(self):
+        self.payloads = {}
+        self.file_keys = {}
+        self.duplicates = 0
+        self.raw_bytes_saved = 0
+        self.duplicate_sources = []
+
+    def add(self, annotation):
+        if annotation.payload_key in self.payloads:
+            # indexed already; once compressed its content key would no longer match
+            return self.payloads[annotation.payload_key]
+        if annotation.lazy_file:
+            # the same unchanged file doesn't need to be hashed twice
+            stat = os.stat(annotation.source_path)
+            file_key = (os.path.abspath(annotation.source_path), stat.st_size, stat.st_mtime,
+                        annotation.compresslevel, annotation.gzipped_file)
+            key = self.file_keys.get(file_key)
+            if key is None:
+                key = self.file_keys[file_key] = annotation.content_key()
+        else:
+            key = annotation.content_key()
+        if key is None:
+            return annotation
+
+        annotation.payload_key = key
+        source = self.payloads.get(key)
+        if source is None:
+            self.payloads[key] = annotation
+            return annotation
+        if source is annotation:
+            return annotation
+
+        self.duplicates += 1
+        self.raw_bytes_saved += annotation.raw_size()
+        self.duplicate_sources.append(source)
+        annotation.share_payload(source)
+        return source
+
+    def clear(self):
+        self.payloads.clear()
+        self.file_keys.clear()
+        self.duplicates = 0
+        self.raw_bytes_saved = 0
+        self.duplicate_sources = []
+
+    def stats(self):
+        return {
+            'payloads': len(self.payloads),
+            'duplicates': self.duplicates,
+            'raw_bytes_saved': self.raw_bytes_saved,
+            'compressed_bytes_saved': sum(len(source.gzip_data or b'') for source in self.duplicate_sources),
+        }
+
+
+class PayloadBudget:
+    # limits on the uncompressed annotation payload embedded in a report, applied
+    # in document order; over budget payloads are cut down to their head and tail
+    # or, with overflow='link', replaced by a link to the file they came from
+    TRUNCATED_MARKER = '\n\n... {0} bytes truncated ...\n\n'
+
+    def __init__(self, max_annotation_bytes=None, max_test_case_bytes=None, max_total_bytes=None,
+                 overflow='truncate', spill_dir=None, min_keep_bytes=256):
+        if overflow not in ('truncate', 'link'):
+            raise ValueError('Unknown payload overflow: {0}'.format(overflow))
+        self.max_annotation_bytes = max_annotation_bytes
+        self.max_test_case_bytes = max_test_case_bytes
+        self.max_total_bytes = max_total_bytes
+        self.overflow = overflow
+        # with overflow='link', payloads that are not backed by a file are written here
+        self.spill_dir = spill_dir
+        self.min_keep_bytes = min_keep_bytes
+        self.total_bytes = 0
+        self.truncated = 0
+        self.linked = 0
+        self.dropped = 0
+        self.bytes_removed = 0
+        self.spilled_files = []
+
+    def apply(self, suite):
+        self.total_bytes = 0
+        self._apply_suite(suite)
+
+    def limit_added(self, annotation):
+        # the per-annotation cap doesn't depend on the rest of the report, so it is
+        # applied as payloads are added, before they are indexed or compressed
+        if self.max_annotation_bytes is None:
+            return
+        size = annotation.payload_size()
+        if size > self.max_annotation_bytes:
+            self.limit(annotation, self.max_annotation_bytes, size)
+
+    def _apply_suite(self, suite):
+        self._apply_group(suite.annotations, None)
+        for row in suite.iter_test_case_rows():
+            if row[5]:
+                self._apply_group(row[5], self.max_test_case_bytes)
+        for sub_suite in suite.sub_suites:
+            self._apply_suite(sub_suite)
+
+    def _apply_group(self, annotations, max_group_bytes):
+        group_bytes = 0
+        for a in annotations:
+            if not a.has_data():
+                continue
+            allowed = self.allowed_bytes(group_bytes, max_group_bytes)
+            size = a.payload_size()
+            if allowed is not None and size > allowed:
+                self.limit(a, allowed, size)
+                size = a.payload_size() if a.has_data() else 0
+            group_bytes += size
+            self.total_bytes += size
+
+    def allowed_bytes(self, group_bytes, max_group_bytes):
+        limits = [self.max_annotation_bytes]
+        if max_group_bytes is not None:
+            limits.append(max_group_bytes - group_bytes)
+        if self.max_total_bytes is not None:
+            limits.append(self.max_total_bytes - self.total_bytes)
+        limits = [max(0, limit) for limit in limits if limit is not None]
+        return min(limits) if limits else None
+
+    def limit(self, annotation, allowed, size):
+        if self.overflow == 'link' and self.link(annotation, size):
+            return
+
+        marker = self.TRUNCATED_MARKER.format(size - allowed).encode()
+        keep = allowed - len(marker)
+        if keep < self.min_keep_bytes:
+            annotation._reset_data()
+            annotation.add_comment('payload_budget', 'Payload of {0} bytes removed, over budget'.format(size))
+            self.dropped += 1
+            self.bytes_removed += size
+            return
+
+        head_bytes = keep // 2
+        head, tail = annotation.read_head_tail(head_bytes, keep - head_bytes)
+        marker = self.TRUNCATED_MARKER.format(size - len(head) - len(tail)).encode()
+        annotation.set_buffer(head + marker + tail, annotation.mime_type, annotation.file_path,
+                              lazy=True, compresslevel=annotation.compresslevel)
+        annotation.add_comment('payload_budget', 'Payload truncated from {0} to {1} bytes'.format(
+            size, len(head) + len(tail)))
+        self.truncated += 1
+        self.bytes_removed += size - len(head) - len(tail)
+
+    def link(self, annotation, size):
+        path = annotation.source_path
+        if path is None or not os.path.isfile(path):
+            if self.spill_dir is None:
+                return False
+            path = self.spill(annotation)
+        annotation.set_link(os.path.abspath(path))
+        annotation.add_comment('payload_budget', 'Payload of {0} bytes linked, over budget'.format(size))
+        self.linked += 1
+        self.bytes_removed += size
+        return True
+
+    def spill(self, annotation):
+        if not os.path.isdir(self.spill_dir):
+            os.makedirs(self.spill_dir)
+        file_name = re.sub(r'[^\w.-]', '_', os.path.basename(annotation.file_path or annotation.name or 'payload'))
+        path = os.path.join(self.spill_dir, '{0}-{1}'.format(len(self.spilled_files) + 1, file_name))
+        with io.open(path, 'wb') as out_file_obj:
+            for chunk in annotation.iter_raw_chunks():
+                out_file_obj.write(chunk)
+        self.spilled_files.append(path)
+        return path
+
+    def stats(self):
+        return {
+            'embedded_bytes': self.total_bytes,
+            'truncated': self.truncated,
+            'linked': self.linked,
+            'dropped': self.dropped,
+            'bytes_removed': self.bytes_removed,
+        }
+
+
+TEST_CASE_STATUSES = frozenset(['passed', 'failed', 'errored', 'blocked', 'unknown', 'in_progress',
+                                'not_applicable', 'ignored'])
+
+# defaults of the fields after name in a test case record
+_RECORD_DEFAULTS = ('passed', 0, None, '')
+
+
+def _as_list(values):
+    # numpy arrays (or anything else with tolist()) are converted in one call
+    if hasattr(values, 'tolist'):
+        values = values.tolist()
+    elif not isinstance(values, list):
+        values = list(values)
+    if values and isinstance(values[0], bytes) and bytes is not str:
+        values = [value.decode('utf-8') for value in values]
+    return values
+
+
+class SuiteRollup(object):
+    # totals over all test cases and annotations below a suite
+    __slots__ = ('test_cases', 'statuses', 'duration', 'annotations', 'suites')
+
+    def __init__(self):
+        self.test_cases = 0
+        self.statuses = {}
+        self.duration = 0
+        self.annotations = 0
+        self.suites = 0
+
+    def add(self, statuses=None, duration=0, annotations=0, suites=0):
+        if statuses:
+            for status, count in statuses.items():
+                self.test_cases += count
+                self.statuses[status] = self.statuses.get(status, 0) + count
+        self.duration += duration
+        self.annotations += annotations
+        self.suites += suites
+
+    def as_dict(self):
+        return {
+            'test_cases': self.test_cases,
+            'statuses': dict((status, count) for status, count in self.statuses.items() if count),
+            'duration': self.duration,
+            'annotations': self.annotations,
+            'suites': self.suites,
+        }
+
+    def custom_data(self):
+        data = [CustomData('rollup_test_cases', str(self.test_cases))]
+        for status in sorted(self.statuses):
+            if self.statuses[status]:
+                data.append(CustomData('rollup_' + status, str(self.statuses[status])))
+        data.append(CustomData('rollup_duration', str(self.duration)))
+        data.append(CustomData('rollup_annotations', str(self.annotations)))
+        return data
+
+
+class TestCase(object):
+    __slots__ = ('name', 'description', 'status', 'start_time', 'duration', '_custom_data', '_annotations',
+                 '_suite')
 
-class TestCase:
     def __init__(self, name, status='passed'):
         self.name = name
         self.description = ''
         self.status = status
-        self.custom_data = []
-        self.annotations = []
+        self._custom_data = None
+        self._annotations = None
         self.start_time = None
         self.duration = 0
+        # the suite whose roll-up counts this test case
+        self._suite = None
+
+    # child lists are only created once something is added
+    @property
+    def custom_data(self):
+        if self._custom_data is None:
+            self._custom_data = []
+        return self._custom_data
+
+    @custom_data.setter
+    def custom_data(self, custom_data):
+        self._custom_data = custom_data
+
+    @property
+    def annotations(self):
+        if self._annotations is None:
+            self._annotations = []
+        return self._annotations
+
+    @annotations.setter
+    def annotations(self, annotations):
+        self._annotations = annotations
+
+    def row(self):
+        return (self.name, self.description, self.status, self.start_time, self.duration,
+                self._annotations or (), self._custom_data or ())
 
     def set_description(self, description):
         self.description = description
@@ -138,19 +1365,24 @@ class TestCase:
         self.start_time = gmt_string
 
     def set_duration(self, duration_ms):
-        self.duration = duration_ms if duration_ms >= 0 else 0
+        duration = duration_ms if duration_ms >= 0 else 0
+        if self._suite is not None:
+            self._suite.roll_up(duration=duration - self.duration)
+        self.duration = duration
 
     set_duration_ms = set_duration
 
     def set_status(self, status):
+        if self._suite is not None and status != self.status:
+            self._suite.roll_up({self.status: -1, status: 1})
         self.status = status
 
     def fail(self, message):
-        self.status = 'failed'
+        self.set_status('failed')
         self.add_text_annotation('Error', 'error', message)
 
     def block(self, message):
-        self.status = 'errored'
+        self.set_status('errored')
         self.add_text_annotation('Fatal', 'fatal', message)
 
     def add_info_annotation(self, message):
@@ -162,16 +1394,31 @@ class TestCase:
     def add_error_annotation(self, message):
         return self.add_text_annotation('Error', 'error', message)
 
-    def add_file_annotation(self, name, file_path, level='info', description='', mime_type='text/plain'):
+    def add_file_annotation(self, name, file_path, level='info', description='', mime_type='text/plain',
+                            lazy=False, gzipped=False):
         fa = self.add_text_annotation(name, level, description)
-        fa.set_file(file_path, mime_type)
+        fa.set_file(file_path, mime_type, lazy, gzipped=gzipped, payload_index=self.get_payload_index(),
+                    payload_budget=self.get_payload_budget(), compression_executor=self.get_compression_executor())
         return fa
 
-    def add_string_buffer_annotation(self, name, string_buffer, level='info', description='', mime_type='text/plain'):
+    def add_string_buffer_annotation(self, name, string_buffer, level='info', description='', mime_type='text/plain',
+                                     lazy=False):
         ba = self.add_text_annotation(name, level, description)
-        ba.set_buffer(string_buffer.encode(), mime_type)
+        ba.set_buffer(string_buffer, mime_type, lazy=lazy, payload_index=self.get_payload_index(),
+                      payload_budget=self.get_payload_budget(), compression_executor=self.get_compression_executor())
         return ba
 
+    def add_file_annotation_async(self, name, file_path, level='info', description='', mime_type='text/plain',
+                                  executor=None, **kwargs):
+        from .aio import add_file_annotation
+        return add_file_annotation(self, name, file_path, level, description, mime_type, executor, **kwargs)
+
+    def add_string_buffer_annotation_async(self, name, string_buffer, level='info', description='',
+                                           mime_type='text/plain', executor=None, **kwargs):
+        from .aio import add_string_buffer_annotation
+        return add_string_buffer_annotation(self, name, string_buffer, level, description, mime_type, executor,
+                                            **kwargs)
+
     def add_link_annotation(self, url, level='info', description='', name=None):
         if not name:
             name = url
@@ -181,7 +1428,7 @@ class TestCase:
 
     def add_text_annotation(self, name, level='info', description=''):
         text_annotation = Annotation(name, level, description)
-        self.annotations.append(text_annotation)
+        self.add_annotation(text_annotation)
         return text_annotation
 
     def add_custom_metric(self, name, value):
@@ -191,20 +1438,255 @@ class TestCase:
 
     def add_annotation(self, annotation):
         self.annotations.append(annotation)
+        if self._suite is not None:
+            self._suite.roll_up(annotations=1)
+
+    def get_payload_index(self):
+        # only known once the test case is in a report
+        return None if self._suite is None else self._suite.get_payload_index()
+
+    def get_payload_budget(self):
+        return None if self._suite is None else self._suite.get_payload_budget()
+
+    def get_compression_executor(self):
+        return None if self._suite is None else self._suite.get_compression_executor()
+
+
+def _column_property(field):
+    def getter(self):
+        case = self.columns.cases.get(self.index)
+        if case is not None:
+            return getattr(case, field)
+        return self.columns.get(self.index, field)
+
+    def setter(self, value):
+        case = self.columns.cases.get(self.index)
+        if case is not None:
+            setattr(case, field, value)
+        else:
+            self.columns.set(self.index, field, value)
+
+    return property(getter, setter)
+
+
+class TestCaseView(TestCase):
+    # TestCase API over one row of a TestCaseColumns store
+    __slots__ = ('columns', 'index')
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    @property
+    def _suite(self):
+        return self.columns.suite
+
+    name = _column_property('name')
+    description = _column_property('description')
+    status = _column_property('status')
+    start_time = _column_property('start_time')
+    duration = _column_property('duration')
+
+    @property
+    def annotations(self):
+        return self.columns.promote(self.index).annotations
+
+    @property
+    def custom_data(self):
+        return self.columns.promote(self.index).custom_data
+
+    def row(self):
+        return self.columns.row(self.index)
+
+
+class TestCaseColumns(object):
+    __slots__ = ('names', 'status_codes', 'status_table', 'status_lookup', 'durations', 'start_times',
+                 'descriptions', 'cases', 'suite')
+
+    def __init__(self, suite=None):
+        # rows appended through append() and extend() are rolled up into suite
+        self.suite = suite
+        self.names = []
+        self.status_codes = array('H')
+        self.status_table = []
+        self.status_lookup = {}
+        self.durations = []
+        # sparse, most cases have neither
+        self.start_times = {}
+        self.descriptions = {}
+        # full TestCase objects for rows that carry annotations or custom data
+        self.cases = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _status_code(self, status):
+        code = self.status_lookup.get(status)
+        if code is None:
+            code = self.status_lookup[status] = len(self.status_table)
+            self.status_table.append(status)
+        return code
+
+    def append(self, name, status='passed', duration=0, start_time=None, description=''):
+        index = len(self.names)
+        # a missing duration is the record default
+        duration = duration if duration is not None and duration >= 0 else 0
+        self.names.append(name)
+        self.status_codes.append(self._status_code(status))
+        self.durations.append(duration)
+        if self.suite is not None:
+            self.suite.roll_up_case(status, duration)
+        if start_time:
+            self.start_times[index] = start_time
+        if description:
+            self.descriptions[index] = description
+        return index
+
+    def extend(self, names, statuses=None, durations=None, start_times=None, descriptions=None):
+        # columns are validated as a whole before anything is appended
+        names = _as_list(names)
+        count = len(names)
+        statuses = ['passed'] * count if statuses is None else _as_list(statuses)
+        if durations is None:
+            durations = [0] * count
+        else:
+            if hasattr(durations, 'clip'):
+                durations = durations.clip(min=0)
+            durations = _as_list(durations)
+            if None in durations:
+                # a missing duration is the record default
+                durations = [0 if duration is None else duration for duration in durations]
+        start_times = None if start_times is None else _as_list(start_times)
+        descriptions = None if descriptions is None else _as_list(descriptions)
+        for column in (statuses, durations, start_times, descriptions):
+            if column is not None and len(column) != count:
+                raise ValueError('Test case columns differ in length: {0} != {1}'.format(len(column), count))
+
+        distinct = set(statuses)
+        unknown = distinct.difference(TEST_CASE_STATUSES)
+        if unknown:
+            raise ValueError('Unknown test case status: {0}'.format(', '.join(sorted(str(s) for s in unknown))))
+        if durations and min(durations) < 0:
+            durations = [duration if duration >= 0 else 0 for duration in durations]
+
+        first = len(self.names)
+        codes = dict((status, self._status_code(status)) for status in distinct)
+        self.names.extend(names)
+        self.status_codes.extend(array('H', [codes[status] for status in statuses]))
+        self.durations.extend(durations)
+        if start_times is not None:
+            self.start_times.update((first + i, value) for i, value in enumerate(start_times) if value)
+        if descriptions is not None:
+            self.descriptions.update((first + i, value) for i, value in enumerate(descriptions) if value)
+        if self.suite is not None and count:
+            self.suite.roll_up(Counter(statuses), sum(durations))
+        return count
+
+    def append_case(self, test_case):
+        index = self.append(test_case.name, test_case.status, test_case.duration)
+        self.cases[index] = test_case
+        test_case._suite = self.suite
+        if self.suite is not None and test_case._annotations:
+            self.suite.roll_up(annotations=len(test_case._annotations))
+        return index
+
+    def get(self, index, field):
+        if field == 'name':
+            return self.names[index]
+        if field == 'status':
+            return self.status_table[self.status_codes[index]]
+        if field == 'duration':
+            return self.durations[index]
+        if field == 'start_time':
+            return self.start_times.get(index)
+        if field == 'description':
+            return self.descriptions.get(index, '')
+        raise AttributeError(field)
+
+    def set(self, index, field, value):
+        if field == 'name':
+            self.names[index] = value
+        elif field == 'status':
+            self.status_codes[index] = self._status_code(value)
+        elif field == 'duration':
+            self.durations[index] = value
+        elif field in ('start_time', 'description'):
+            values = self.start_times if field == 'start_time' else self.descriptions
+            if value:
+                values[index] = value
+            else:
+                values.pop(index, None)
+        else:
+            raise AttributeError(field)
+
+    def promote(self, index):
+        case = self.cases.get(index)
+        if case is None:
+            case = TestCase(self.names[index], self.get(index, 'status'))
+            case.description = self.get(index, 'description')
+            case.start_time = self.get(index, 'start_time')
+            case.duration = self.durations[index]
+            case._suite = self.suite
+            self.cases[index] = case
+        return case
+
+    def view(self, index):
+        case = self.cases.get(index)
+        return case if case is not None else TestCaseView(self, index)
+
+    def row(self, index):
+        case = self.cases.get(index)
+        if case is not None:
+            return case.row()
+        return (self.names[index], self.descriptions.get(index, ''), self.status_table[self.status_codes[index]],
+                self.start_times.get(index), self.durations[index], (), ())
+
+    def iter_rows(self):
+        for index in range(len(self.names)):
+            yield self.row(index)
 
 
 class TestSuite:
-    def __init__(self, name):
+    def __init__(self, name, columnar=False):
         # optional sub-suites
         self.sub_suites = []
+        self.sub_suite_index = {}
+        self._indexed_count = 0
         self.is_root_suite = False
         self.name = name
         self.description = ''
         self.duration = 0
         self.start_time = None
         self.test_cases = []
+        # optional compact storage for bulk runs, written after test_cases;
+        # test cases added after the first row are stored there as well
+        self.columnar = columnar
+        self.test_case_columns = None
         self.custom_data = []
         self.annotations = []
+        self.parent = None
+        self.rollup = SuiteRollup()
+
+    def roll_up(self, statuses=None, duration=0, annotations=0, suites=0):
+        # applies a change to this suite and every suite above it
+        suite = self
+        while suite is not None:
+            suite.rollup.add(statuses, duration, annotations, suites)
+            suite = suite.parent
+
+    def roll_up_case(self, status, duration, annotations=0):
+        # roll_up() for a single added test case, the common case kept cheap
+        suite = self
+        while suite is not None:
+            rollup = suite.rollup
+            rollup.test_cases += 1
+            rollup.statuses[status] = rollup.statuses.get(status, 0) + 1
+            rollup.duration += duration
+            rollup.annotations += annotations
+            suite = suite.parent
+
+    def get_rollup(self):
+        return self.rollup.as_dict()
 
     def set_description(self, description):
         self.description = description
@@ -217,35 +1699,166 @@ class TestSuite:
 
     set_duration_ms = set_duration
 
+    def set_columnar(self, columnar=True):
+        # test cases added from now on, and suites created by name, use column storage
+        self.columnar = columnar
+
+    def get_test_case_columns(self):
+        if self.test_case_columns is None:
+            self.test_case_columns = TestCaseColumns(self)
+        return self.test_case_columns
+
     def add_test_case(self, tc):
-        self.test_cases.append(tc)
+        if isinstance(tc, TestCaseView):
+            # a row of another suite's columns is copied; once promoted, the row
+            # has a TestCase with its annotations, which is added instead
+            case = tc.columns.cases.get(tc.index)
+            if case is None:
+                columns = self.get_test_case_columns()
+                name, description, status, start_time, duration = tc.row()[:5]
+                return columns.view(columns.append(name, status, duration, start_time, description))
+            tc = case
+        if self.columnar or self.test_case_columns is not None:
+            # columns are written after test_cases, so once a suite has columns
+            # every test case goes there to keep the order they were added in
+            self.get_test_case_columns().append_case(tc)
+        else:
+            self.test_cases.append(tc)
+            tc._suite = self
+            self.roll_up_case(tc.status, tc.duration, len(tc._annotations or ()))
         return tc
 
+    def add_test_case_record(self, name, status='passed', duration=0, start_time=None, description=''):
+        return self.get_test_case_columns().append(name, status, duration, start_time, description)
+
+    def add_test_cases_from_records(self, records):
+        # records are (name, status, duration, start_time, description) tuples with
+        # optional trailing fields, dicts with those keys, or a numpy structured array
+        fields = getattr(getattr(records, 'dtype', None), 'names', None)
+        if fields:
+            known = ('name', 'status', 'duration', 'start_time', 'description')
+            return self.add_test_cases_from_columns(
+                **dict((field, records[field]) for field in fields if field in known))
+
+        names, statuses, durations, start_times, descriptions = [], [], [], [], []
+        for record in records:
+            if isinstance(record, dict):
+                name = record['name']
+                status = record.get('status', 'passed')
+                duration = record.get('duration', 0)
+                start_time = record.get('start_time')
+                description = record.get('description', '')
+            else:
+                name, status, duration, start_time, description = \
+                    tuple(record) + _RECORD_DEFAULTS[len(record) - 1:]
+            names.append(name)
+            statuses.append(status)
+            durations.append(duration)
+            start_times.append(start_time)
+            descriptions.append(description)
+        return self.get_test_case_columns().extend(names, statuses, durations, start_times, descriptions)
+
+    def add_test_cases_from_columns(self, name, status=None, duration=None, start_time=None, description=None):
+        # one sequence (or numpy array) per field, returns the number of test cases added
+        return self.get_test_case_columns().extend(name, status, duration, start_time, description)
+
+    def test_case_count(self):
+        count = len(self.test_cases)
+        if self.test_case_columns is not None:
+            count += len(self.test_case_columns)
+        return count
+
+    def iter_test_cases(self):
+        for tc in self.test_cases:
+            yield tc
+        if self.test_case_columns is not None:
+            for index in range(len(self.test_case_columns)):
+                yield self.test_case_columns.view(index)
+
+    def iter_test_case_rows(self):
+        for tc in self.test_cases:
+            yield tc.row()
+        if self.test_case_columns is not None:
+            for row in self.test_case_columns.iter_rows():
+                yield row
+
+    def iter_annotations(self):
+        # same order the writers visit them
+        for a in self.annotations:
+            yield a
+        for row in self.iter_test_case_rows():
+            for a in row[5]:
+                yield a
+        for sub_suite in self.sub_suites:
+            for a in sub_suite.iter_annotations():
+                yield a
+
     def get_or_add_test_suite(self, suite_name):
         if not suite_name:
             # write under root suite
             return self.get_or_add_test_suite('uncategorized')
-        for suite in self.sub_suites:
-            if suite_name == suite.name:
-                return suite
+        if self._indexed_count != len(self.sub_suites):
+            self._rebuild_sub_suite_index()
+        suite = self.sub_suite_index.get(suite_name)
+        if suite is not None:
+            return suite
         return self.add_test_suite(suite_name)
 
+    def get_or_add_suite_path(self, suite_names):
+        suite = self
+        for suite_name in suite_names:
+            suite = suite.get_or_add_test_suite(suite_name)
+        return suite
+
+    def add_test_case_to_path(self, suite_names, tc):
+        return self.get_or_add_suite_path(suite_names).add_test_case(tc)
+
     def add_test_suite(self, ts_or_name):
         if isinstance(ts_or_name, str) or (sys.version_info < (3,0) and isinstance(ts_or_name, unicode)):
-            ts_or_name = TestSuite(ts_or_name)
+            ts_or_name = TestSuite(ts_or_name, self.columnar)
+        if self._indexed_count != len(self.sub_suites):
+            self._rebuild_sub_suite_index()
         self.sub_suites.append(ts_or_name)
+        # the first suite with a name wins, as with a linear scan
+        self.sub_suite_index.setdefault(ts_or_name.name, ts_or_name)
+        self._indexed_count += 1
+        ts_or_name.parent = self
+        rollup = ts_or_name.rollup
+        self.roll_up(rollup.statuses, rollup.duration, rollup.annotations, rollup.suites + 1)
         return ts_or_name
 
-    def add_file_annotation(self, name, file_path, level='info', description='', mime_type='text/plain'):
+    def _rebuild_sub_suite_index(self):
+        # sub_suites was modified directly
+        self.sub_suite_index = {}
+        for suite in self.sub_suites:
+            self.sub_suite_index.setdefault(suite.name, suite)
+        self._indexed_count = len(self.sub_suites)
+
+    def add_file_annotation(self, name, file_path, level='info', description='', mime_type='text/plain',
+                            lazy=False, gzipped=False):
         fa = self.add_text_annotation(name, level, description)
-        fa.set_file(file_path, mime_type)
+        fa.set_file(file_path, mime_type, lazy, gzipped=gzipped, payload_index=self.get_payload_index(),
+                    payload_budget=self.get_payload_budget(), compression_executor=self.get_compression_executor())
         return fa
 
-    def add_string_buffer_annotation(self, name, string_buffer, level='info', description='', mime_type='text/plain'):
+    def add_string_buffer_annotation(self, name, string_buffer, level='info', description='', mime_type='text/plain',
+                                     lazy=False):
         ba = self.add_text_annotation(name, level, description)
-        ba.set_buffer(string_buffer.encode(), mime_type)
+        ba.set_buffer(string_buffer, mime_type, lazy=lazy, payload_index=self.get_payload_index(),
+                      payload_budget=self.get_payload_budget(), compression_executor=self.get_compression_executor())
         return ba
 
+    def add_file_annotation_async(self, name, file_path, level='info', description='', mime_type='text/plain',
+                                  executor=None, **kwargs):
+        from .aio import add_file_annotation
+        return add_file_annotation(self, name, file_path, level, description, mime_type, executor, **kwargs)
+
+    def add_string_buffer_annotation_async(self, name, string_buffer, level='info', description='',
+                                           mime_type='text/plain', executor=None, **kwargs):
+        from .aio import add_string_buffer_annotation
+        return add_string_buffer_annotation(self, name, string_buffer, level, description, mime_type, executor,
+                                            **kwargs)
+
     def add_link_annotation(self, url, level='info', description='', name=None):
         if not name:
             name = url
@@ -255,7 +1868,7 @@ class TestSuite:
 
     def add_text_annotation(self, name, level='info', description=''):
         text_annotation = Annotation(name, level, description)
-        self.annotations.append(text_annotation)
+        self.add_annotation(text_annotation)
         return text_annotation
 
     def add_custom_metric(self, name, value):
@@ -265,11 +1878,42 @@ class TestSuite:
 
     def add_annotation(self, annotation):
         self.annotations.append(annotation)
+        self.roll_up(annotations=1)
+
+    def get_payload_index(self):
+        # the report's PayloadIndex when deduplication is enabled
+        report = self._report()
+        return None if report is None else report.payload_index
+
+    def get_payload_budget(self):
+        # the report's PayloadBudget when one is set
+        report = self._report()
+        return None if report is None else report.payload_budget
+
+    def get_compression_executor(self):
+        # the report's executor when compression is set, payloads added eagerly are compressed on it
+        report = self._report()
+        return None if report is None else report.get_compression_executor()
+
+    def _report(self):
+        suite = self
+        while suite.parent is not None:
+            suite = suite.parent
+        return suite if suite.is_root_suite else None
+
+
+def suite_custom_data(test_suite, rollup=False):
+    # the suite's custom data, followed by its roll-up totals when enabled
+    if not rollup or test_suite.is_root_suite:
+        return test_suite.custom_data
+    return test_suite.custom_data + test_suite.rollup.custom_data()
 
 
 class XmlWriter:
-    def __init__(self, report):
+    def __init__(self, report, stats=None):
         self.report = report
+        self.stats = stats
+        self.rollup = getattr(report, 'rollup_custom_data', False)
 
         if not report.product_version:
             reporter_string = '<reporter schema_version="1.0"/>'
@@ -279,102 +1923,382 @@ class XmlWriter:
 
         self.dom = parseString(reporter_string)
 
-    def write(self, out_file, to_pretty=False):
-        doc_elem = self.dom.documentElement
-        self._write_suite(doc_elem, self.report.get_root_suite())
-        xml_attrs = {'encoding': 'utf-8'}
-        if to_pretty:
-            xml_attrs.update(indent='\t', newl='\n')
-
-        if not out_file:
-            out_file = sys.stdout
+    def write(self, out_file, to_pretty=False, compress=None, compresslevel=9):
+        with collect_stats(self.stats):
+            doc_elem = self.dom.documentElement
+            with stats_phase('tree_building'):
+                self._write_suite(doc_elem, self.report.get_root_suite())
+            xml_attrs = {'encoding': 'utf-8'}
+            if to_pretty:
+                xml_attrs.update(indent='\t', newl='\n')
 
-        if isinstance(out_file, str) or (sys.version_info < (3,0) and isinstance(out_file, unicode)):
-            file_attrs = {}
-            if sys.version_info > (3,0):
-                file_attrs = {'encoding': 'utf-8'}
-            with open(out_file, 'w', **file_attrs) as file_obj:
-                self.dom.writexml(file_obj, **xml_attrs)
-        else:
-            self.dom.writexml(out_file, **xml_attrs)
+            with open_output(out_file, compress, compresslevel) as file_obj:
+                with stats_phase('serialization'):
+                    self.dom.writexml(file_obj, **xml_attrs)
 
     def _write_suite(self, parent_node, test_suite):
         # don't explicitly add suite for root suite
         suite_elem = parent_node
         if not test_suite.is_root_suite:
+            stats_count('suites')
             suite_elem = self.dom.createElement('test_suite')
-            suite_elem.setAttribute('name', XmlWriter.invalid_xml_remove(test_suite.name))
-            if test_suite.description:
-                suite_elem.setAttribute('description', XmlWriter.invalid_xml_remove(test_suite.description))
-            if test_suite.start_time:
-                suite_elem.setAttribute('start_time', test_suite.start_time)
-            if test_suite.duration > 0:
-                suite_elem.setAttribute('duration', str(test_suite.duration))
+            for attr_name, attr_value in XmlWriter.suite_attributes(test_suite):
+                suite_elem.setAttribute(attr_name, attr_value)
             parent_node.appendChild(suite_elem)
 
         for a in test_suite.annotations:
             a.write_xml(suite_elem, self.dom)
 
-        for d in test_suite.custom_data:
+        for d in suite_custom_data(test_suite, self.rollup):
             d.write_xml(suite_elem, self.dom)
 
-        for tc in test_suite.test_cases:
-            self._write_test_case(suite_elem, tc)
+        for row in test_suite.iter_test_case_rows():
+            self._write_test_case(suite_elem, row)
 
         # write child suites
         for sub_suite in test_suite.sub_suites:
             self._write_suite(suite_elem, sub_suite)
 
-    def _write_test_case(self, parent_node, test_case):
+    def _write_test_case(self, parent_node, test_case_row):
+        name, description, status, start_time, duration, annotations, custom_data = test_case_row
+        stats_count('test_cases')
         elem_tc = self.dom.createElement('test_case')
-
-        elem_tc.setAttribute('name', XmlWriter.invalid_xml_remove(test_case.name))
-        if test_case.description:
-            elem_tc.setAttribute('description', XmlWriter.invalid_xml_remove(test_case.description))
-        elem_tc.setAttribute('status', test_case.status)
-        if test_case.start_time:
-            elem_tc.setAttribute('start_time', test_case.start_time)
-        elem_tc.setAttribute('duration', str(test_case.duration))
+        for attr_name, attr_value in XmlWriter.case_attributes(name, description, status, start_time, duration):
+            elem_tc.setAttribute(attr_name, attr_value)
         parent_node.appendChild(elem_tc)
 
-        for a in test_case.annotations:
+        for a in annotations:
             a.write_xml(elem_tc, self.dom)
 
-        for d in test_case.custom_data:
+        for d in custom_data:
             d.write_xml(elem_tc, self.dom)
 
+    @staticmethod
+    def reporter_attributes(report):
+        attrs = [('schema_version', '1.0')]
+        if report.product_version:
+            attrs.append(('product_version', '{0}'.format(report.product_version)))
+        return attrs
+
+    @staticmethod
+    def suite_attributes(test_suite):
+        attrs = [('name', XmlWriter.invalid_xml_remove(test_suite.name))]
+        if test_suite.description:
+            attrs.append(('description', XmlWriter.invalid_xml_remove(test_suite.description)))
+        if test_suite.start_time:
+            attrs.append(('start_time', test_suite.start_time))
+        if test_suite.duration > 0:
+            attrs.append(('duration', str(test_suite.duration)))
+        return attrs
+
+    @staticmethod
+    def test_case_attributes(test_case):
+        return XmlWriter.case_attributes(test_case.name, test_case.description, test_case.status,
+                                         test_case.start_time, test_case.duration)
+
+    @staticmethod
+    def case_attributes(name, description, status, start_time, duration):
+        attrs = [('name', XmlWriter.invalid_xml_remove(name))]
+        if description:
+            attrs.append(('description', XmlWriter.invalid_xml_remove(description)))
+        attrs.append(('status', status))
+        if start_time:
+            attrs.append(('start_time', start_time))
+        attrs.append(('duration', str(duration)))
+        return attrs
+
     @staticmethod
     def invalid_xml_remove(string_to_clean):
         if not isinstance(string_to_clean, str):
             if sys.version_info > (3,0) or not isinstance(string_to_clean, unicode):
                 return ''
 
-        # http://stackoverflow.com/questions/1707890/fast-way-to-filter-illegal-xml-unicode-chars-in-python
-        illegal_unichrs = [
-            (0x00, 0x08), (0x0B, 0x1F), (0x7F, 0x84), (0x86, 0x9F),
-            (0xD800, 0xDFFF), (0xFDD0, 0xFDDF), (0xFFFE, 0xFFFF),
-            (0x1FFFE, 0x1FFFF), (0x2FFFE, 0x2FFFF), (0x3FFFE, 0x3FFFF),
-            (0x4FFFE, 0x4FFFF), (0x5FFFE, 0x5FFFF), (0x6FFFE, 0x6FFFF),
-            (0x7FFFE, 0x7FFFF), (0x8FFFE, 0x8FFFF), (0x9FFFE, 0x9FFFF),
-            (0xAFFFE, 0xAFFFF), (0xBFFFE, 0xBFFFF), (0xCFFFE, 0xCFFFF),
-            (0xDFFFE, 0xDFFFF), (0xEFFFE, 0xEFFFF), (0xFFFFE, 0xFFFFF),
-            (0x10FFFE, 0x10FFFF)]
+        if WriteStats.active is None:
+            return sanitizer.clean(string_to_clean)
+        with WriteStats.active.phase('sanitize'):
+            return sanitizer.clean(string_to_clean)
 
-        if sys.version_info > (3,0):
-            illegal_ranges = ['%s-%s' % (chr(low), chr(high))
-                            for (low, high) in illegal_unichrs
-                            if low < sys.maxunicode]
 
-            illegal_xml_pattern = '[%s]' % ''.join(illegal_ranges)
+# minidom sorts attributes by name before Python 3.8
+_SORTED_ATTRIBUTES = sys.version_info < (3, 8)
+
+
+class StreamingXmlWriter:
+    # same output as XmlWriter, written element by element without building a DOM,
+    # apart from whitespace in attributes, which is escaped on all Python versions;
+    # before Python 3.8 minidom's pretty printing also puts an element's lone CDATA
+    # section on a line of its own, which is whitespace the reader would keep
+    def __init__(self, report, stats=None):
+        self.report = report
+        self.stats = stats
+        self.rollup = getattr(report, 'rollup_custom_data', False)
+        self.out = None
+        self.indent = ''
+        self.newl = ''
+
+    def write(self, out_file, to_pretty=False, compress=None, compresslevel=9):
+        if to_pretty:
+            self.indent, self.newl = '\t', '\n'
+        else:
+            self.indent, self.newl = '', ''
+
+        with collect_stats(self.stats):
+            with open_output(out_file, compress, compresslevel) as file_obj:
+                with stats_phase('serialization'):
+                    self._write_document(file_obj)
+
+    def _write_document(self, out):
+        self.out = out
+        try:
+            out.write('<?xml version="1.0" encoding="utf-8"?>' + self.newl)
+            self._write_suite(self.report.get_root_suite())
+        finally:
+            self.out = None
+
+    def _write_suite(self, test_suite):
+        if test_suite.is_root_suite:
+            tag = 'reporter'
+            attrs = XmlWriter.reporter_attributes(self.report)
+        else:
+            tag = 'test_suite'
+            attrs = XmlWriter.suite_attributes(test_suite)
+            stats_count('suites')
+
+        custom_data = suite_custom_data(test_suite, self.rollup)
+        has_children = bool(test_suite.annotations or custom_data or
+                            test_suite.test_case_count() or test_suite.sub_suites)
+        self.start_element(tag, attrs, has_children)
+        if not has_children:
+            return
+
+        for a in test_suite.annotations:
+            a.write_xml_stream(self)
+
+        for d in custom_data:
+            d.write_xml_stream(self)
+
+        for row in test_suite.iter_test_case_rows():
+            self._write_test_case(row)
+
+        # write child suites
+        for sub_suite in test_suite.sub_suites:
+            self._write_suite(sub_suite)
+
+        self.end_element(tag)
+
+    def _write_test_case(self, test_case_row):
+        name, description, status, start_time, duration, annotations, custom_data = test_case_row
+        stats_count('test_cases')
+        has_children = bool(annotations or custom_data)
+        self.start_element('test_case', XmlWriter.case_attributes(name, description, status, start_time, duration),
+                           has_children)
+        if not has_children:
+            return
+
+        for a in annotations:
+            a.write_xml_stream(self)
+
+        for d in custom_data:
+            d.write_xml_stream(self)
+
+        self.end_element('test_case')
+
+    def start_element(self, tag, attrs, has_children=True):
+        self.out.write(self._start_tag(tag, attrs) + ('>' if has_children else '/>') + self.newl)
+
+    def end_element(self, tag):
+        self.out.write('{0}</{1}>{2}'.format(self.indent, tag, self.newl))
+
+    def write_cdata_element(self, tag, attrs, data):
+        self.out.write(self._start_tag(tag, attrs) + '>')
+        self.write_cdata(data)
+        self.out.write('</{0}>{1}'.format(tag, self.newl))
+
+    def write_cdata(self, data):
+        if data.find(']]>') >= 0:
+            raise ValueError("']]>' not allowed in a CDATA section")
+        self.out.write('<![CDATA[' + data + ']]>')
+
+    def write_cdata_chunks_element(self, tag, attrs, chunks):
+        self.out.write(self._start_tag(tag, attrs) + '>')
+        self.write_cdata_chunks(chunks)
+        self.out.write('</{0}>{1}'.format(tag, self.newl))
+
+    def write_cdata_chunks(self, chunks):
+        # only used for base64 payloads, which can never contain ']]>'
+        self.out.write('<![CDATA[')
+        for chunk in chunks:
+            self.out.write(chunk)
+        self.out.write(']]>')
+
+    def _start_tag(self, tag, attrs):
+        if _SORTED_ATTRIBUTES:
+            attrs = sorted(attrs, key=lambda attr: attr[0])
+        parts = [self.indent, '<', tag]
+        for attr_name, attr_value in attrs:
+            parts.append(' {0}="{1}"'.format(attr_name, StreamingXmlWriter.escape_attribute(attr_value)))
+        return ''.join(parts)
+
+    @staticmethod
+    def escape_attribute(value):
+        if not value:
+            return ''
+        value = value.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+        # attribute value normalization would turn these into spaces when read
+        return value.replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#9;')
+
+
+class _CountingFile:
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.bytes_written = 0
+
+    def write(self, data):
+        data = data.encode('utf-8')
+        self.file_obj.write(data)
+        self.bytes_written += len(data)
+
+
+class SplittingXmlWriter(StreamingXmlWriter):
+    # starts a new report file at a suite boundary before the current one would
+    # grow past max_bytes; suites that were open are reopened in the new file
+    def __init__(self, report, max_bytes, stats=None):
+        StreamingXmlWriter.__init__(self, report, stats)
+        self.max_bytes = max_bytes
+        self.out_file = None
+        self.files = []
+        self.open_suites = []
+        self.header_bytes = 0
+        self._reporter_start = None
+
+    def write(self, out_file, to_pretty=False, compress=None, compresslevel=9):
+        if to_pretty:
+            self.indent, self.newl = '\t', '\n'
+        else:
+            self.indent, self.newl = '', ''
+        if not is_file_path(out_file):
+            raise ValueError('Splitting a report by size needs a file path, not {0!r}'.format(out_file))
+        self.out_file = out_file
+        # the limit applies to the uncompressed size of each part
+        self.compress = out_file.endswith('.gz') if compress is None else compress
+        self.compresslevel = compresslevel
+        self.files = []
+        with collect_stats(self.stats):
+            with stats_phase('serialization'):
+                return self._write_parts()
+
+    def _write_parts(self):
+        self._open_part()
+        try:
+            root = self.report.get_root_suite()
+            has_children = bool(root.annotations or root.custom_data or root.test_case_count() or root.sub_suites)
+            if not has_children:
+                # nothing but the reporter element
+                self._close_part(has_children=False)
+                return self.files
+            self._write_suite_content(root)
+            self._close_part()
+        finally:
+            if self.out is not None:
+                self.out.file_obj.close()
+                self.out = None
+        return self.files
+
+    def part_file_name(self, index):
+        if index == 0:
+            return self.out_file
+        out_file, gz_ext = self.out_file, ''
+        if out_file.endswith('.gz'):
+            out_file, gz_ext = out_file[:-3], '.gz'
+        root, ext = os.path.splitext(out_file)
+        return '{0}.{1}{2}{3}'.format(root, index + 1, ext, gz_ext)
+
+    def _open_part(self):
+        file_name = self.part_file_name(len(self.files))
+        if self.compress:
+            file_obj = gzip.GzipFile(file_name, 'wb', self.compresslevel)
+        else:
+            file_obj = io.open(file_name, 'wb')
+        self.out = _CountingFile(file_obj)
+        self.files.append(file_name)
+        self.out.write('<?xml version="1.0" encoding="utf-8"?>' + self.newl)
+        self.header_bytes = self.out.bytes_written
+        self._reporter_start = self._start_tag('reporter', XmlWriter.reporter_attributes(self.report))
+
+    def _close_part(self, has_children=True):
+        if not has_children:
+            self.out.write(self._reporter_start + '/>' + self.newl)
         else:
-            illegal_ranges = [u'%s-%s' % (unichr(low), unichr(high))
-                            for (low, high) in illegal_unichrs
-                            if low < sys.maxunicode]
+            self._ensure_reporter()
+            for _ in self.open_suites:
+                self.end_element('test_suite')
+            self.end_element('reporter')
+        self.out.file_obj.close()
+        self.out = None
+
+    def _ensure_reporter(self):
+        # the reporter and reopened suites are written lazily so a new part is only
+        # started when there is content for it
+        if self._reporter_start is None:
+            return
+        self.out.write(self._reporter_start + '>' + self.newl)
+        self._reporter_start = None
+        for test_suite in self.open_suites:
+            self.start_element('test_suite', XmlWriter.suite_attributes(test_suite))
+
+    def _roll_over(self):
+        self._close_part()
+        self._open_part()
 
-            illegal_xml_pattern = u'[%s]' % u''.join(illegal_ranges)
+    def _write_suite_content(self, test_suite):
+        self._ensure_reporter()
+        for a in test_suite.annotations:
+            a.write_xml_stream(self)
 
-        illegal_xml_re = re.compile(illegal_xml_pattern)
-        return illegal_xml_re.sub('', string_to_clean)
+        for d in suite_custom_data(test_suite, self.rollup):
+            d.write_xml_stream(self)
+
+        for row in test_suite.iter_test_case_rows():
+            self._write_test_case(row)
+
+        for sub_suite in test_suite.sub_suites:
+            self._write_suite(sub_suite)
+
+    def _write_suite(self, test_suite):
+        written = self.out.bytes_written
+        if self._reporter_start is None and written > self.header_bytes and \
+                written + SplittingXmlWriter.estimated_size(test_suite) > self.max_bytes:
+            self._roll_over()
+
+        self._ensure_reporter()
+        stats_count('suites')
+        custom_data = suite_custom_data(test_suite, self.rollup)
+        has_children = bool(test_suite.annotations or custom_data or
+                            test_suite.test_case_count() or test_suite.sub_suites)
+        self.start_element('test_suite', XmlWriter.suite_attributes(test_suite), has_children)
+        if not has_children:
+            return
+
+        self.open_suites.append(test_suite)
+        self._write_suite_content(test_suite)
+        self.open_suites.pop()
+        self.end_element('test_suite')
+
+    @staticmethod
+    def estimated_size(test_suite):
+        # the suite's own content; sub-suites are split points of their own
+        size = 100 + len(test_suite.name or '')
+        for a in test_suite.annotations:
+            size += a.estimated_size()
+        for d in suite_custom_data(test_suite, True):
+            size += 50 + len(d.name or '') + len(d.value or '')
+        for row in test_suite.iter_test_case_rows():
+            size += 80 + len(row[0] or '') + len(row[1] or '')
+            for a in row[5]:
+                size += a.estimated_size()
+            for d in row[6]:
+                size += 50 + len(d.name or '') + len(d.value or '')
+        return size
 
 
 class TestspaceReport(TestSuite):
@@ -382,6 +2306,17 @@ class TestspaceReport(TestSuite):
         TestSuite.__init__(self, '__root__')
         self.is_root_suite = True
         self.product_version = None
+        self.compression_executor = None
+        self.compression_workers = None
+        self.compression_window = None
+        self.compresslevel = 9
+        # the executor created for a 'thread' or 'process' compression_executor
+        self.compression_pool = None
+        self.payload_index = None
+        self.payload_budget = None
+        self.rollup_custom_data = False
+        self.write_stats = None
+        self.stats_options = None
 
     def get_root_suite(self):
         return self
@@ -389,6 +2324,281 @@ class TestspaceReport(TestSuite):
     def set_product_version(self, product_version):
         self.product_version = product_version
 
-    def write_xml(self, out_file, to_pretty=False):
-        writer = XmlWriter(self)
-        writer.write(out_file, to_pretty)
+    def set_compression(self, executor='thread', max_workers=None, compresslevel=9, window=None):
+        # executor is 'thread', 'process', None (compress on the calling thread)
+        # or a concurrent.futures.Executor owned by the caller; window is how many
+        # payloads are compressed ahead of the writer, twice the workers by default;
+        # payloads added eagerly from now on are compressed on the executor too
+        if executor not in (None, 'thread', 'process') and not hasattr(executor, 'submit'):
+            raise ValueError('Unknown compression executor: {0}'.format(executor))
+        self.shutdown_compression_pool()
+        self.compression_executor = executor
+        self.compression_workers = max_workers
+        self.compression_window = window
+        self.compresslevel = compresslevel
+
+    def set_deduplication(self, enabled=True):
+        # payloads added to the report from now on are looked up before they are
+        # compressed; those of test cases not yet in the report, and everything
+        # else, are shared when the report is written
+        self.payload_index = PayloadIndex() if enabled else None
+
+    def set_rollup_custom_data(self, enabled=True):
+        # writes each suite's roll-up totals as rollup_* custom data
+        self.rollup_custom_data = enabled
+
+    def set_payload_budget(self, max_annotation_bytes=None, max_test_case_bytes=None, max_total_bytes=None,
+                           overflow='truncate', spill_dir=None):
+        # sizes are uncompressed payload bytes, None means unlimited
+        if max_annotation_bytes is None and max_test_case_bytes is None and max_total_bytes is None:
+            self.payload_budget = None
+            return
+        self.payload_budget = PayloadBudget(max_annotation_bytes, max_test_case_bytes, max_total_bytes,
+                                            overflow, spill_dir)
+
+    def apply_payload_budget(self):
+        if self.payload_budget is None:
+            return None
+        self.payload_budget.apply(self)
+        return self.payload_budget.stats()
+
+    def deduplicate_annotations(self):
+        if self.payload_index is None:
+            return 0
+        duplicates = self.payload_index.duplicates
+        for a in self.iter_annotations():
+            if a.has_data():
+                self.payload_index.add(a)
+        return self.payload_index.duplicates - duplicates
+
+    def enable_stats(self, enabled=True, trace_memory=False, callback=None):
+        # callback is called with the stats dict after each write_xml()
+        self.stats_options = {'trace_memory': trace_memory, 'callback': callback} if enabled else None
+        self.write_stats = None
+
+    def get_stats(self):
+        stats = {}
+        if self.payload_index is not None:
+            stats['deduplication'] = self.payload_index.stats()
+        if self.payload_budget is not None:
+            stats['payload_budget'] = self.payload_budget.stats()
+        if payload_cache is not None:
+            stats['payload_cache'] = payload_cache.stats()
+        if self.write_stats is not None:
+            stats['write'] = self.write_stats.as_dict()
+        return stats
+
+    def _start_write_stats(self):
+        if self.stats_options is None:
+            return None
+        return WriteStats(self.stats_options['trace_memory'])
+
+    def _finish_write_stats(self, stats):
+        if stats is None:
+            return
+        self.write_stats = stats
+        if self.stats_options['callback'] is not None:
+            self.stats_options['callback'](stats.as_dict())
+
+    def compress_annotations(self, executor, window=None):
+        # starts compressing pending payloads, returns how many were submitted now
+        if window is None:
+            window = self.compression_window or 2 * (self.compression_workers or os.cpu_count() or 1)
+        return CompressionWindow(executor, self.iter_annotations(), window, self.compresslevel).fill()
+
+    def get_compression_executor(self):
+        # payloads added eagerly start compressing on this executor as they are added;
+        # one created for 'thread' or 'process' is shut down when the report is written
+        if self.compression_executor is None or hasattr(self.compression_executor, 'submit'):
+            return self.compression_executor
+        if self.compression_pool is None:
+            import concurrent.futures
+            if self.compression_executor == 'process':
+                self.compression_pool = concurrent.futures.ProcessPoolExecutor(self.compression_workers)
+            else:
+                self.compression_pool = concurrent.futures.ThreadPoolExecutor(self.compression_workers)
+        return self.compression_pool
+
+    def shutdown_compression_pool(self):
+        # waits for the payloads still being compressed
+        if self.compression_pool is not None:
+            self.compression_pool.shutdown()
+            self.compression_pool = None
+
+    def write_xml_async(self, out_file, to_pretty=False, executor=None, compress=None, compresslevel=9):
+        # coroutine, see aio.AsyncXmlWriter
+        from .aio import write_xml
+        return write_xml(self, out_file, to_pretty, executor, compress=compress, compresslevel=compresslevel)
+
+    def write_xml(self, out_file, to_pretty=False, streaming=False, max_bytes=None, compress=None, compresslevel=9):
+        # elements are counted by the writers as they are written
+        stats = self._start_write_stats()
+        with collect_stats(stats):
+            files = self._write_xml(out_file, to_pretty, streaming, max_bytes, compress, compresslevel, stats)
+        self._finish_write_stats(stats)
+        return files
+
+    def _write_xml(self, out_file, to_pretty, streaming, max_bytes, compress, compresslevel, stats=None):
+        with stats_phase('payload_budget'):
+            self.apply_payload_budget()
+        with stats_phase('deduplication'):
+            self.deduplicate_annotations()
+        executor = self.get_compression_executor()
+        try:
+            if executor is not None:
+                # payloads are resolved in document order as the writer reaches them
+                self.compress_annotations(executor)
+            if max_bytes:
+                # always streamed, returns the list of files written
+                return SplittingXmlWriter(self, max_bytes, stats).write(out_file, to_pretty, compress, compresslevel)
+            writer = StreamingXmlWriter(self, stats) if streaming else XmlWriter(self, stats)
+            writer.write(out_file, to_pretty, compress, compresslevel)
+        finally:
+            self.shutdown_compression_pool()
+
+
+class IncrementalXmlWriter(StreamingXmlWriter):
+    # writes each test case as soon as it is added; a checkpoint file next to the
+    # report records the last consistent state so repair_report() can close it
+    def __init__(self, out_file, product_version=None, to_pretty=False, checkpoint_interval=100,
+                 rollup_custom_data=False):
+        StreamingXmlWriter.__init__(self, TestspaceReport())
+        self.report.set_product_version(product_version)
+        # roll-ups of the report and open suites are kept up to date for progress
+        # reporting, suites write theirs when closed
+        self.rollup = rollup_custom_data
+        if to_pretty:
+            self.indent, self.newl = '\t', '\n'
+        self.out_file = out_file
+        # checkpoint_interval=None writes no checkpoints, for output that needn't survive a crash
+        self.checkpoint_file = out_file + '.checkpoint' if checkpoint_interval is not None else None
+        self.checkpoint_interval = checkpoint_interval
+        self.open_suites = []
+        self.cases_since_checkpoint = 0
+
+        file_attrs = {}
+        if sys.version_info > (3,0):
+            file_attrs = {'encoding': 'utf-8'}
+        self.out = open(out_file, 'w', **file_attrs)
+        self.out.write('<?xml version="1.0" encoding="utf-8"?>' + self.newl)
+        self.start_element('reporter', XmlWriter.reporter_attributes(self.report))
+        self.checkpoint()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_root_suite(self):
+        return self.report
+
+    def current_suite(self):
+        return self.open_suites[-1] if self.open_suites else self.report
+
+    def open_suite(self, ts_or_name):
+        if isinstance(ts_or_name, str) or (sys.version_info < (3,0) and isinstance(ts_or_name, unicode)):
+            ts_or_name = TestSuite(ts_or_name)
+        self.start_element('test_suite', XmlWriter.suite_attributes(ts_or_name))
+        parent = self.current_suite()
+        ts_or_name.parent = parent
+        rollup = ts_or_name.rollup
+        parent.roll_up(rollup.statuses, rollup.duration, rollup.annotations, rollup.suites + 1)
+        self.open_suites.append(ts_or_name)
+        return ts_or_name
+
+    def close_suite(self):
+        # annotations and custom data added while the suite was open go last
+        test_suite = self.open_suites.pop()
+        self._write_suite_children(test_suite)
+        self.end_element('test_suite')
+        self.checkpoint()
+        return test_suite
+
+    def add_test_case(self, tc):
+        row = tc.row()
+        self._write_test_case(row)
+        self.current_suite().roll_up_case(row[2], row[4], len(row[5]))
+        if self.checkpoint_file is None:
+            return tc
+        self.out.flush()
+        self.cases_since_checkpoint += 1
+        if self.checkpoint_interval and self.cases_since_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+        return tc
+
+    def add_test_case_to_path(self, suite_names, tc):
+        # keeps open suites that share a prefix with the path, so consecutive
+        # results for the same suite end up in one element
+        suite_names = list(suite_names)
+        common = 0
+        while common < len(self.open_suites) and common < len(suite_names) and \
+                self.open_suites[common].name == suite_names[common]:
+            common += 1
+        while len(self.open_suites) > common:
+            self.close_suite()
+        for suite_name in suite_names[common:]:
+            self.open_suite(suite_name)
+        return self.add_test_case(tc)
+
+    def add_test_suite(self, test_suite):
+        # write a complete suite tree under the current suite
+        self._write_suite(test_suite)
+        rollup = test_suite.rollup
+        self.current_suite().roll_up(rollup.statuses, rollup.duration, rollup.annotations, rollup.suites + 1)
+        self.checkpoint()
+        return test_suite
+
+    def _write_suite_children(self, test_suite):
+        for a in test_suite.annotations:
+            a.write_xml_stream(self)
+        for d in suite_custom_data(test_suite, self.rollup):
+            d.write_xml_stream(self)
+
+    def checkpoint(self):
+        if self.checkpoint_file is None:
+            return
+        self.out.flush()
+        os.fsync(self.out.fileno())
+        state = {
+            'offset': os.fstat(self.out.fileno()).st_size,
+            'open_elements': ['reporter'] + ['test_suite'] * len(self.open_suites),
+            'indent': self.indent,
+            'newl': self.newl,
+        }
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as file_obj:
+            json.dump(state, file_obj)
+        # replaced in one step, a crash must not leave the report without a checkpoint
+        getattr(os, 'replace', os.rename)(tmp_file, self.checkpoint_file)
+        self.cases_since_checkpoint = 0
+
+    def close(self):
+        if self.out is None:
+            return
+        while self.open_suites:
+            self.close_suite()
+        self._write_suite_children(self.report)
+        self.end_element('reporter')
+        self.out.close()
+        self.out = None
+        if self.checkpoint_file is not None and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+
+def repair_report(out_file):
+    # truncate an interrupted incremental report to its last checkpoint and close it
+    checkpoint_file = out_file + '.checkpoint'
+    if not os.path.isfile(checkpoint_file):
+        return False
+
+    with open(checkpoint_file) as file_obj:
+        state = json.load(file_obj)
+
+    with io.open(out_file, 'r+b') as file_obj:
+        file_obj.truncate(state['offset'])
+        file_obj.seek(state['offset'])
+        for tag in reversed(state['open_elements']):
+            file_obj.write('{0}</{1}>{2}'.format(state['indent'], tag, state['newl']).encode('utf-8'))
+    os.remove(checkpoint_file)
+    return True
@@ -9,4 +9,10 @@ setup(
     author="Ivailo Petrov",
     author_email='ivailop@s2technologies.com',
     description="Module for generating Testspace XML format result files",
+    entry_points={
+        'console_scripts': [
+            'testspace-xml-merge=python_testspace_xml.merge:main',
+            'testspace-xml-junit=python_testspace_xml.junit:main',
+        ],
+    },
 )
@@ -0,0 +1,71 @@
+import asyncio
+import io
+
+from python_testspace_xml import testspace_xml
+
+
+def build_report(tmp_path):
+    report = testspace_xml.TestspaceReport()
+    suite = report.get_or_add_test_suite('suite')
+    for i in range(20):
+        log_path = tmp_path / 'log{0}.txt'.format(i)
+        log_path.write_bytes(b'log line\n' * (i * 100))
+        test_case = testspace_xml.TestCase('case {0}'.format(i))
+        test_case.add_file_annotation('log', str(log_path), lazy=True)
+        suite.add_test_case(test_case)
+    suite.add_string_buffer_annotation('suite log', 'suite output', lazy=True)
+    return report
+
+
+def test_async_annotations_keep_call_order(tmp_path):
+    log_path = tmp_path / 'big.log'
+    log_path.write_bytes(b'x' * 100000)
+
+    async def build():
+        test_case = testspace_xml.TestCase('case')
+        await asyncio.gather(
+            test_case.add_file_annotation_async('file', str(log_path)),
+            test_case.add_string_buffer_annotation_async('buffer', 'text'),
+            test_case.add_file_annotation_async('missing', '/does/not/exist'))
+        return test_case
+
+    test_case = asyncio.run(build())
+    assert [a.name for a in test_case.annotations] == ['file', 'buffer', 'missing']
+    assert test_case.annotations[0].read_payload() == b'x' * 100000
+    assert test_case.annotations[1].read_payload() == b'text'
+    assert test_case.annotations[2].level == 'error'
+
+
+def test_write_xml_async_matches_sync(tmp_path):
+    expected = io.StringIO()
+    build_report(tmp_path).write_xml(expected, to_pretty=True, streaming=True)
+
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0)
+
+    async def write(path):
+        task = asyncio.ensure_future(ticker())
+        await build_report(tmp_path).write_xml_async(path, to_pretty=True)
+        task.cancel()
+
+    out_file = str(tmp_path / 'async.xml')
+    asyncio.run(write(out_file))
+    with io.open(out_file, encoding='utf-8') as file_obj:
+        assert file_obj.read() == expected.getvalue()
+    # the writer yielded to other coroutines while serializing
+    assert len(ticks) > 10
+
+
+def test_write_xml_async_applies_payload_budget(tmp_path):
+    report = testspace_xml.TestspaceReport()
+    annotation = report.add_string_buffer_annotation('random', bytes(bytearray(range(256))) * 400)
+    report.set_payload_budget(max_annotation_bytes=1000)
+
+    out_file = str(tmp_path / 'async.xml')
+    asyncio.run(report.write_xml_async(out_file))
+    assert len(annotation.read_payload()) <= 1000
+    assert report.get_stats()['payload_budget']['truncated'] == 1
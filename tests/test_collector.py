@@ -0,0 +1,103 @@
+import multiprocessing
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import pytest
+
+from python_testspace_xml import collector, testspace_xml
+
+
+def run_worker(channel, worker):
+    with collector.ResultSender(channel, batch_size=4) as sender:
+        for i in range(10):
+            test_case = testspace_xml.TestCase('case {0}.{1}'.format(worker, i))
+            test_case.set_duration(i)
+            if i == 3:
+                test_case.fail('broken')
+                test_case.add_string_buffer_annotation('log', 'worker log', lazy=True)
+                test_case.add_custom_metric('metric', str(i))
+            sender.send(['workers', 'worker {0}'.format(worker)], test_case)
+
+
+def check_report(report, workers):
+    for worker in range(workers):
+        suite = report.get_or_add_suite_path(['workers', 'worker {0}'.format(worker)])
+        assert [tc.name for tc in suite.test_cases] == ['case {0}.{1}'.format(worker, i) for i in range(10)]
+        failing = suite.test_cases[3]
+        assert failing.status == 'failed'
+        assert [a.name for a in failing.annotations] == ['Error', 'log']
+        assert failing.annotations[1].read_payload() == b'worker log'
+        assert failing.custom_data[0].value == '3'
+
+
+def test_round_trip_record():
+    test_case = testspace_xml.TestCase('a', 'errored')
+    annotation = test_case.add_text_annotation('note', 'warn', 'description')
+    annotation.add_comment('label', 'comment')
+    suite_names, decoded = collector.decode_test_case(collector.encode_test_case(['s'], test_case))
+    assert suite_names == ('s',)
+    assert decoded.row()[:5] == test_case.row()[:5]
+    assert decoded.annotations[0].comments[0].comment == 'comment'
+
+
+def test_collect_from_queue():
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker, args=(queue, w)) for w in range(3)]
+    for process in workers:
+        process.start()
+    report = collector.ResultCollector(testspace_xml.TestspaceReport()).collect_from_queue(queue, 3)
+    for process in workers:
+        process.join()
+    check_report(report, 3)
+
+
+def test_collect_from_socket():
+    report = testspace_xml.TestspaceReport()
+    result_collector = collector.ResultCollector(report)
+
+    # bind first to find a free port, then hand it to the collector
+    probe = Listener(('localhost', 0))
+    address = probe.address
+    probe.close()
+
+    server = threading.Thread(target=result_collector.serve, args=(address, 2))
+    server.start()
+    workers = []
+    for w in range(2):
+        for _ in range(50):
+            try:
+                sender = collector.ResultSender.connect(address, result_collector.authkey)
+                break
+            except OSError:
+                time.sleep(0.05)
+        workers.append(threading.Thread(target=run_worker, args=(sender.channel, w)))
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    server.join()
+    assert result_collector.received == 20
+    check_report(report, 2)
+
+
+def test_connect_requires_authkey():
+    with pytest.raises(ValueError):
+        collector.ResultSender.connect(('localhost', 0), None)
+    first = collector.ResultCollector(testspace_xml.TestspaceReport())
+    second = collector.ResultCollector(testspace_xml.TestspaceReport())
+    assert len(first.authkey) == 32
+    assert first.authkey != second.authkey
+    assert collector.ResultCollector(None, authkey=b'shared').authkey == b'shared'
+
+
+def test_collect_into_incremental_writer(tmp_path):
+    out_file = str(tmp_path / 'collected.xml')
+    with testspace_xml.IncrementalXmlWriter(out_file) as writer:
+        result_collector = collector.ResultCollector(writer)
+        for w in range(2):
+            test_case = testspace_xml.TestCase('case')
+            result_collector.add_batch([collector.encode_test_case(['a', str(w)], test_case)])
+    from python_testspace_xml import reader
+    check = reader.load_report(out_file)
+    assert [s.name for s in check.get_or_add_test_suite('a').sub_suites] == ['0', '1']
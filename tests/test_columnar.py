@@ -0,0 +1,160 @@
+import io
+
+import pytest
+
+from python_testspace_xml import testspace_xml
+
+
+def write_to_string(report, streaming):
+    out = io.StringIO()
+    report.write_xml(out, to_pretty=True, streaming=streaming)
+    return out.getvalue()
+
+
+def build_reports():
+    object_report = testspace_xml.TestspaceReport()
+    columnar_report = testspace_xml.TestspaceReport()
+    columnar_report.set_columnar()
+
+    for report in (object_report, columnar_report):
+        suite = report.get_or_add_test_suite('bulk')
+        for i in range(20):
+            test_case = testspace_xml.TestCase('case {0}'.format(i), 'failed' if i % 3 else 'passed')
+            test_case.set_duration(i * 1.5)
+            if i % 5 == 0:
+                test_case.set_start_time('2024-01-01T00:00:{0:02d}'.format(i))
+                test_case.set_description('desc {0}'.format(i))
+            if i % 7 == 0:
+                test_case.add_info_annotation('note {0}'.format(i))
+            suite.add_test_case(test_case)
+    return object_report, columnar_report
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_columnar_output_matches_objects(streaming):
+    object_report, columnar_report = build_reports()
+    assert columnar_report.get_or_add_test_suite('bulk').test_case_columns is not None
+    assert write_to_string(columnar_report, streaming) == write_to_string(object_report, streaming)
+
+
+def test_records_match_objects():
+    object_report = testspace_xml.TestspaceReport()
+    record_report = testspace_xml.TestspaceReport()
+    object_report.get_or_add_test_suite('s').add_test_case(testspace_xml.TestCase('a', 'errored'))
+    test_case = testspace_xml.TestCase('b')
+    test_case.set_duration(-1)
+    object_report.get_or_add_test_suite('s').add_test_case(test_case)
+
+    suite = record_report.get_or_add_test_suite('s')
+    suite.add_test_case_record('a', 'errored')
+    suite.add_test_case_record('b', duration=-1)
+    assert suite.test_cases == []
+    assert write_to_string(record_report, True) == write_to_string(object_report, True)
+
+
+def test_view_reads_and_writes_columns():
+    suite = testspace_xml.TestSuite('s')
+    suite.add_test_case_record('a', duration=3)
+    view = list(suite.iter_test_cases())[0]
+    assert isinstance(view, testspace_xml.TestCaseView)
+    assert (view.name, view.status, view.duration, view.description) == ('a', 'passed', 3, '')
+
+    view.set_status('failed')
+    view.set_description('now described')
+    assert suite.test_case_columns.row(0)[:3] == ('a', 'now described', 'failed')
+    assert 0 not in suite.test_case_columns.cases
+
+    view.fail('broken')
+    promoted = suite.test_case_columns.cases[0]
+    assert promoted.status == 'failed'
+    assert [a.name for a in promoted.annotations] == ['Error']
+    assert view.annotations is promoted.annotations
+
+
+def test_slots_and_lazy_lists():
+    test_case = testspace_xml.TestCase('a')
+    assert not hasattr(test_case, '__dict__')
+    assert test_case.row()[5:] == ((), ())
+    assert test_case._annotations is None
+    annotation = testspace_xml.Annotation('a')
+    assert not hasattr(annotation, '__dict__')
+    assert annotation._comments is None
+
+
+def test_text_annotation_has_no_payload(tmp_path):
+    test_case = testspace_xml.TestCase('a')
+    text = test_case.add_text_annotation('note', 'info', 'description')
+    test_case.fail('broken')
+    for annotation in test_case.annotations:
+        assert annotation._payload is None
+        assert annotation.file_path is None and not annotation.has_data()
+    assert testspace_xml.Annotation.__slots__ == ('name', 'level', 'description', '_payload', '_comments')
+
+    buffer = test_case.add_string_buffer_annotation('out', 'output')
+    link = test_case.add_link_annotation('http://example.com/log')
+    assert buffer._payload is not None and buffer.read_payload() == b'output'
+    assert link._payload.link_file
+    text.mime_type = None
+    assert text._payload is None
+
+
+def test_bulk_records_match_objects():
+    object_report, _ = build_reports()
+    records = []
+    for i in range(20):
+        record = {'name': 'case {0}'.format(i), 'status': 'failed' if i % 3 else 'passed', 'duration': i * 1.5}
+        if i % 5 == 0:
+            record.update(start_time='2024-01-01T00:00:{0:02d}'.format(i), description='desc {0}'.format(i))
+        records.append(record if i % 2 else (record['name'], record['status'], record['duration'],
+                                               record.get('start_time'), record.get('description', '')))
+    bulk_report = testspace_xml.TestspaceReport()
+    suite = bulk_report.get_or_add_test_suite('bulk')
+    assert suite.add_test_cases_from_records(records) == 20
+    for i in range(0, 20, 7):
+        suite.get_test_case_columns().promote(i).add_info_annotation('note {0}'.format(i))
+    assert write_to_string(bulk_report, True) == write_to_string(object_report, True)
+
+
+def test_bulk_columns_validate_and_clamp():
+    suite = testspace_xml.TestSuite('bulk')
+    with pytest.raises(ValueError):
+        suite.add_test_cases_from_columns(['a', 'b'], ['passed', 'bogus'])
+    with pytest.raises(ValueError):
+        suite.add_test_cases_from_columns(['a', 'b'], ['passed'])
+    assert suite.test_case_count() == 0
+
+    suite.add_test_cases_from_records([('a',), ('b', 'failed', -5)])
+    suite.add_test_cases_from_columns(['c', 'd'], duration=[3, -1])
+    rows = list(suite.iter_test_case_rows())
+    assert [(row[0], row[2], row[4]) for row in rows] == [
+        ('a', 'passed', 0), ('b', 'failed', 0), ('c', 'passed', 3), ('d', 'passed', 0)]
+
+
+def test_bulk_missing_durations():
+    suite = testspace_xml.TestSuite('bulk')
+    suite.add_test_cases_from_records([{'name': 'a', 'duration': None}, ('b', 'failed', None), ('c', 'passed', 2)])
+    suite.add_test_case_record('d', duration=None)
+    assert [(row[0], row[4]) for row in suite.iter_test_case_rows()] == [('a', 0), ('b', 0), ('c', 2), ('d', 0)]
+    assert suite.get_rollup()['duration'] == 2
+
+
+def test_bulk_and_single_adds_keep_order():
+    suite = testspace_xml.TestSuite('mixed')
+    suite.add_test_case(testspace_xml.TestCase('A'))
+    suite.add_test_cases_from_records([('B', 'failed')])
+    suite.add_test_case(testspace_xml.TestCase('C'))
+    suite.add_test_case_record('D')
+    assert [tc.name for tc in suite.iter_test_cases()] == ['A', 'B', 'C', 'D']
+    assert [row[0] for row in suite.iter_test_case_rows()] == ['A', 'B', 'C', 'D']
+    assert suite.get_rollup()['statuses'] == {'passed': 3, 'failed': 1}
+
+
+def test_bulk_numpy_structured_array():
+    numpy = pytest.importorskip('numpy')
+    records = numpy.array([('a', 'passed', 1.5), ('b', 'failed', -2.0)],
+                          dtype=[('name', 'U8'), ('status', 'S8'), ('duration', 'f8')])
+    suite = testspace_xml.TestSuite('bulk')
+    assert suite.add_test_cases_from_records(records) == 2
+    rows = list(suite.iter_test_case_rows())
+    assert [(row[0], row[2], row[4]) for row in rows] == [('a', 'passed', 1.5), ('b', 'failed', 0)]
+    assert all(type(row[4]) is float for row in rows)
@@ -0,0 +1,256 @@
+import array
+import asyncio
+import concurrent.futures
+import gzip
+import io
+
+import pytest
+
+from python_testspace_xml import testspace_xml
+
+
+def build_report(tmp_path):
+    report = testspace_xml.TestspaceReport()
+    for s in range(3):
+        suite = report.get_or_add_test_suite('suite {0}'.format(s))
+        for c in range(4):
+            log_path = tmp_path / 'log_{0}_{1}.txt'.format(s, c)
+            log_path.write_bytes(b'suite %d case %d\n' % (s, c) * 1000)
+            test_case = testspace_xml.TestCase('case {0}'.format(c))
+            test_case.add_file_annotation('log', str(log_path), lazy=True)
+            test_case.add_string_buffer_annotation('out', 'output {0}'.format(c) * 100, lazy=True)
+            suite.add_test_case(test_case)
+    return report
+
+
+def write_to_string(report, streaming=True):
+    out = io.StringIO()
+    report.write_xml(out, to_pretty=True, streaming=streaming)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_parallel_output_matches_serial(tmp_path, executor):
+    expected = write_to_string(build_report(tmp_path))
+    report = build_report(tmp_path)
+    report.set_compression(executor, max_workers=2)
+    assert write_to_string(report) == expected
+
+
+def test_caller_owned_executor(tmp_path):
+    import concurrent.futures
+    expected = write_to_string(build_report(tmp_path), streaming=False)
+    report = build_report(tmp_path)
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        report.set_compression(executor)
+        assert write_to_string(report, streaming=False) == expected
+        assert report.compress_annotations(executor) == 0
+
+
+def test_compression_window_is_bounded(tmp_path):
+    import concurrent.futures
+    report = build_report(tmp_path)
+    annotations = list(report.iter_annotations())
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        assert report.compress_annotations(executor, window=3) == 3
+        for i, a in enumerate(annotations):
+            # the next payloads in document order are compressing, no others
+            assert [b for b in annotations if b.gzip_future is not None] == annotations[i:i + 3]
+            a.resolve()
+        assert all(a.gzip_future is None and a.gzip_data for a in annotations)
+
+
+def test_small_window_output_matches_serial(tmp_path):
+    expected = write_to_string(build_report(tmp_path))
+    report = build_report(tmp_path)
+    report.set_compression('thread', max_workers=2, window=1)
+    assert write_to_string(report) == expected
+
+
+def test_eager_payloads_use_executor(tmp_path):
+    build_report(tmp_path)
+
+    class RecordingExecutor(concurrent.futures.ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            submitted.append(fn.__name__)
+            return super(RecordingExecutor, self).submit(fn, *args, **kwargs)
+
+    submitted = []
+    log_path = tmp_path / 'log_0_0.txt'
+    buffer = bytearray(b'output' * 1000)
+    with RecordingExecutor(2) as executor:
+        report = testspace_xml.TestspaceReport()
+        report.set_compression(executor)
+        test_case = report.get_or_add_test_suite('suite').add_test_case(testspace_xml.TestCase('case'))
+        from_file = test_case.add_file_annotation('log', str(log_path))
+        from_buffer = test_case.add_string_buffer_annotation('out', buffer)
+        buffer[:6] = b'change'
+        assert submitted == ['gzip_file', 'gzip_bytes']
+        assert from_file.read_payload() == log_path.read_bytes()
+        assert from_buffer.read_payload() == b'output' * 1000
+
+
+
+def test_eager_payloads_use_report_pool(tmp_path):
+    def build(report):
+        suite = report.get_or_add_test_suite('suite')
+        for c in range(4):
+            test_case = suite.add_test_case(testspace_xml.TestCase('case {0}'.format(c)))
+            test_case.add_string_buffer_annotation('out', 'output {0}'.format(c) * 100)
+        return report
+
+    expected = write_to_string(build(testspace_xml.TestspaceReport()))
+    report = testspace_xml.TestspaceReport()
+    report.set_compression('thread')
+    build(report)
+    assert report.compression_pool is not None
+    assert all(a.gzip_future is not None or a.gzip_data for a in report.iter_annotations())
+    assert write_to_string(report) == expected
+    # the pool lasts until the report is written
+    assert report.compression_pool is None
+
+
+def test_compression_level():
+    data = b'compressible data ' * 10000
+    fast = testspace_xml.Annotation('fast')
+    fast.set_buffer(data, lazy=True, compresslevel=1)
+    best = testspace_xml.Annotation('best')
+    best.set_buffer(data, lazy=True, compresslevel=9)
+    assert gzip.decompress(fast.resolve()) == data
+    assert len(best.resolve()) < len(fast.gzip_data)
+
+
+def test_unknown_executor():
+    with pytest.raises(ValueError):
+        testspace_xml.TestspaceReport().set_compression('gpu')
+
+
+def build_duplicate_report(tmp_path):
+    env_path = tmp_path / 'env.txt'
+    env_path.write_bytes(b'PATH=/usr/bin\n' * 500)
+    report = testspace_xml.TestspaceReport()
+    suite = report.get_or_add_test_suite('suite')
+    for c in range(5):
+        test_case = testspace_xml.TestCase('case {0}'.format(c))
+        test_case.add_file_annotation('env', str(env_path), lazy=True)
+        test_case.add_string_buffer_annotation('config', 'shared config\n' * 100, lazy=True)
+        test_case.add_string_buffer_annotation('own', 'case {0}'.format(c), lazy=True)
+        suite.add_test_case(test_case)
+    return report
+
+
+@pytest.mark.parametrize('executor', [None, 'thread'])
+def test_deduplicated_output_matches(tmp_path, executor):
+    expected = write_to_string(build_duplicate_report(tmp_path))
+    report = build_duplicate_report(tmp_path)
+    report.set_compression(executor)
+    report.set_deduplication()
+    assert write_to_string(report) == expected
+
+    stats = report.get_stats()['deduplication']
+    assert stats['payloads'] == 7
+    assert stats['duplicates'] == 8
+    assert stats['raw_bytes_saved'] == 4 * (len(b'PATH=/usr/bin\n') * 500 + len(b'shared config\n') * 100)
+    assert stats['compressed_bytes_saved'] > 0
+
+    test_cases = report.get_or_add_test_suite('suite').test_cases
+    assert test_cases[0].annotations[1].gzip_data is test_cases[4].annotations[1].gzip_data
+
+
+@pytest.mark.parametrize('async_add', [False, True])
+def test_eager_duplicates_compressed_once(tmp_path, monkeypatch, async_add):
+    env_path = tmp_path / 'env.txt'
+    env_path.write_bytes(b'PATH=/usr/bin\n' * 500)
+
+    def build(report):
+        suite = report.get_or_add_test_suite('suite')
+        for c in range(5):
+            test_case = suite.add_test_case(testspace_xml.TestCase('case {0}'.format(c)))
+            if async_add:
+                asyncio.run(test_case.add_file_annotation_async('env', str(env_path)))
+            else:
+                test_case.add_file_annotation('env', str(env_path))
+            test_case.add_string_buffer_annotation('config', 'shared config\n' * 100)
+        return report
+
+    expected = write_to_string(build(testspace_xml.TestspaceReport()))
+
+    compressed = []
+    gzip_bytes = testspace_xml.gzip_bytes
+    gzip_file = testspace_xml.gzip_file
+    monkeypatch.setattr(testspace_xml, 'gzip_bytes', lambda *args: compressed.append(args) or gzip_bytes(*args))
+    monkeypatch.setattr(testspace_xml, 'gzip_file', lambda *args: compressed.append(args) or gzip_file(*args))
+    report = testspace_xml.TestspaceReport()
+    # annotations are checked against the index as they are added to the report
+    report.set_deduplication()
+    build(report)
+    assert len(compressed) == 2
+    assert report.get_stats()['deduplication']['duplicates'] == 8
+    test_cases = report.get_or_add_test_suite('suite').test_cases
+    assert test_cases[4].annotations[1].resolve() is test_cases[0].annotations[1].gzip_data
+
+    assert write_to_string(report) == expected
+    assert len(compressed) == 2
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_deduplication_stats_stable_across_writes(tmp_path, lazy):
+    report = testspace_xml.TestspaceReport()
+    report.set_deduplication()
+    suite = report.get_or_add_test_suite('suite')
+    for c in range(3):
+        test_case = suite.add_test_case(testspace_xml.TestCase('case {0}'.format(c)))
+        test_case.add_string_buffer_annotation('config', 'shared config\n' * 100, lazy=lazy)
+    expected = write_to_string(report)
+    stats = report.get_stats()['deduplication']
+    assert stats['payloads'] == 1
+    assert stats['duplicates'] == 2
+
+    assert write_to_string(report) == expected
+    assert report.get_stats()['deduplication'] == stats
+
+
+@pytest.mark.parametrize('make_buffer', [bytes, bytearray, memoryview, lambda data: array.array('I', data)])
+@pytest.mark.parametrize('lazy', [True, False])
+def test_buffer_types(make_buffer, lazy):
+    data = b'0123456789abcdef' * 4096
+    annotation = testspace_xml.Annotation('buffer')
+    annotation.set_buffer(make_buffer(data), lazy=lazy)
+    assert annotation.raw_bytes == len(data)
+    assert annotation.read_payload() == data
+
+
+def test_buffer_not_copied():
+    data = bytearray(b'x' * 1000)
+    annotation = testspace_xml.Annotation('buffer')
+    annotation.set_buffer(data, lazy=True)
+    assert annotation.buffer.obj is data
+    text = testspace_xml.Annotation('text')
+    text.set_buffer(u'café', lazy=True)
+    assert text.read_payload() == u'café'.encode('utf-8')
+
+
+def test_mapped_file_matches_read(tmp_path, monkeypatch):
+    log_path = tmp_path / 'big.bin'
+    log_path.write_bytes(bytes(bytearray(range(256))) * 20000)
+    mapped = testspace_xml.Annotation('mapped')
+    mapped.set_file(str(log_path), lazy=True)
+    assert b''.join(mapped.iter_gzip_chunks()) == testspace_xml.gzip_file(str(log_path))
+    key = mapped.content_key()
+
+    monkeypatch.setattr(testspace_xml, 'MMAP_MIN_SIZE', len(log_path.read_bytes()) + 1)
+    read = testspace_xml.Annotation('read')
+    read.set_file(str(log_path))
+    assert read.read_payload() == log_path.read_bytes()
+    assert mapped.content_key() == key
+    with open(str(log_path), 'rb') as file_obj, testspace_xml.map_file(file_obj) as view:
+        assert view is None
+
+
+def test_memoryview_with_process_executor():
+    import concurrent.futures
+    annotation = testspace_xml.Annotation('buffer')
+    annotation.set_buffer(memoryview(b'payload ' * 100), lazy=True)
+    with concurrent.futures.ProcessPoolExecutor(1) as executor:
+        annotation.compress_async(executor)
+        assert annotation.read_payload() == b'payload ' * 100
@@ -0,0 +1,44 @@
+import gzip
+import io
+
+import pytest
+
+from python_testspace_xml import reader, testspace_xml
+
+
+def build_report():
+    report = testspace_xml.TestspaceReport()
+    report.set_product_version('pytest')
+    suite = report.get_or_add_test_suite(u'caf\xe9 suite')
+    for i in range(50):
+        test_case = testspace_xml.TestCase('case {0}'.format(i))
+        test_case.add_string_buffer_annotation('log', 'line\n' * i)
+        suite.add_test_case(test_case)
+    return report
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+@pytest.mark.parametrize('to_pretty', [False, True])
+def test_gz_path_matches_plain(tmp_path, streaming, to_pretty):
+    report = build_report()
+    plain_file = str(tmp_path / 'report.xml')
+    gz_file = str(tmp_path / 'report.xml.gz')
+    report.write_xml(plain_file, to_pretty=to_pretty, streaming=streaming)
+    report.write_xml(gz_file, to_pretty=to_pretty, streaming=streaming, compresslevel=1)
+    with open(plain_file, 'rb') as file_obj:
+        assert gzip.open(gz_file).read() == file_obj.read()
+
+
+def test_explicit_compress_to_stream():
+    out = io.BytesIO()
+    build_report().write_xml(out, streaming=True, compress=True)
+    assert not out.closed
+    text = gzip.decompress(out.getvalue()).decode('utf-8')
+    assert text.startswith('<?xml version="1.0" encoding="utf-8"?><reporter')
+
+
+def test_split_gz_parts_and_reader(tmp_path):
+    files = build_report().write_xml(str(tmp_path / 'report.xml.gz'), max_bytes=3000)
+    assert files[1] == str(tmp_path / 'report.2.xml.gz')
+    names = [tc.name for file_name in files for _, tc in reader.iter_test_cases(file_name)]
+    assert names == ['case {0}'.format(i) for i in range(50)]
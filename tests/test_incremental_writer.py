@@ -0,0 +1,70 @@
+import os
+import shutil
+
+from lxml import etree
+
+from python_testspace_xml import testspace_xml
+
+
+def test_incremental_report(tmp_path):
+    out_file = str(tmp_path / 'incremental.xml')
+    with testspace_xml.IncrementalXmlWriter(out_file, product_version='pytest', to_pretty=True) as writer:
+        suite = writer.open_suite('suite')
+        suite.add_text_annotation('added while open')
+        for i in range(3):
+            writer.add_test_case(testspace_xml.TestCase('case {0}'.format(i)))
+        writer.open_suite('nested')
+        failing = testspace_xml.TestCase('failing')
+        failing.fail('broken')
+        writer.add_test_case(failing)
+
+        done = testspace_xml.TestSuite('complete')
+        done.add_test_case(testspace_xml.TestCase('done'))
+        writer.add_test_suite(done)
+        assert os.path.exists(out_file + '.checkpoint')
+
+    assert not os.path.exists(out_file + '.checkpoint')
+    root = etree.parse(out_file).getroot()
+    assert root.get('product_version') == 'pytest'
+    assert [c.get('name') for c in root.xpath("//test_suite[@name='suite']/test_case")] == \
+        ['case 0', 'case 1', 'case 2']
+    assert len(root.xpath("//test_suite[@name='nested']/test_suite[@name='complete']/test_case")) == 1
+    assert len(root.xpath("//test_suite[@name='suite']/annotation")) == 1
+
+
+def test_repair_truncated_report(tmp_path):
+    out_file = str(tmp_path / 'crashed.xml')
+    writer = testspace_xml.IncrementalXmlWriter(out_file, checkpoint_interval=2)
+    writer.open_suite('suite')
+    for i in range(5):
+        writer.add_test_case(testspace_xml.TestCase('case {0}'.format(i)))
+    # simulate the process dying without close()
+    crashed_file = str(tmp_path / 'copy.xml')
+    shutil.copy(out_file, crashed_file)
+    shutil.copy(out_file + '.checkpoint', crashed_file + '.checkpoint')
+    with open(crashed_file, 'a') as file_obj:
+        file_obj.write('<test_case name="half')
+    writer.close()
+
+    assert testspace_xml.repair_report(crashed_file)
+    assert not testspace_xml.repair_report(crashed_file)
+    root = etree.parse(crashed_file).getroot()
+    assert [c.get('name') for c in root.xpath('//test_case')] == ['case 0', 'case 1', 'case 2', 'case 3']
+
+
+def test_incremental_column_rows(tmp_path):
+    bulk = testspace_xml.TestSuite('bulk')
+    bulk.add_test_cases_from_records([('a', 'passed', 1), ('b', 'failed', 2)])
+    bulk.test_case_columns.view(1).add_info_annotation('note')
+
+    out_file = str(tmp_path / 'incremental.xml')
+    with testspace_xml.IncrementalXmlWriter(out_file) as writer:
+        suite = writer.open_suite('suite')
+        for tc in bulk.iter_test_cases():
+            writer.add_test_case(tc)
+        assert suite.get_rollup() == {'test_cases': 2, 'statuses': {'passed': 1, 'failed': 1}, 'duration': 3,
+                                      'annotations': 1, 'suites': 0}
+
+    root = etree.parse(out_file).getroot()
+    assert [c.get('name') for c in root.xpath('//test_case')] == ['a', 'b']
+    assert len(root.xpath('//test_case/annotation')) == 1
@@ -0,0 +1,88 @@
+import gzip
+
+import pytest
+
+from python_testspace_xml import junit
+from python_testspace_xml.reader import load_report
+
+JUNIT_PYTEST = b'''<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="pytest" errors="1" failures="1" skipped="1" tests="4" time="1.5" timestamp="2024-01-01T00:00:00">
+    <properties><property name="python" value="3.11"/></properties>
+    <testcase classname="tests.test_a" name="test_pass" time="0.25"/>
+    <testcase classname="tests.test_a" name="test_fail" time="0.5">
+      <failure message="assert 1 == 2">Traceback
+AssertionError</failure>
+      <system-out>captured out</system-out>
+    </testcase>
+    <testcase classname="tests.test_b" name="test_skip" time="0"><skipped message="not on linux"/></testcase>
+    <testcase classname="tests.test_b" name="test_error" time="0.1"><error message="fixture failed"/></testcase>
+    <system-err>suite stderr</system-err>
+  </testsuite>
+</testsuites>
+'''
+
+JUNIT_JAVA = b'''<?xml version="1.0" encoding="UTF-8"?>
+<testsuite name="com.example.CalcTest" tests="2" time="0.02">
+  <testcase classname="com.example.CalcTest" name="adds" time="0.01"/>
+  <testcase classname="com.example.CalcTest" name="divides" time="0.01"/>
+</testsuite>
+'''
+
+
+def rows(suite):
+    return [(row[0], row[2], row[4]) for row in suite.iter_test_case_rows()]
+
+
+def test_convert_pytest_layout(tmp_path):
+    source = tmp_path / 'junit.xml'
+    source.write_bytes(JUNIT_PYTEST)
+    out_file = str(tmp_path / 'testspace.xml')
+    junit.convert_file(str(source), out_file, product_version='1.0')
+
+    report = load_report(out_file)
+    assert report.product_version == '1.0'
+    suite = report.sub_suites[0]
+    assert suite.name == 'pytest'
+    assert suite.duration == 1500
+    assert suite.start_time == '2024-01-01T00:00:00'
+    assert [(d.name, d.value) for d in suite.custom_data] == [('python', '3.11')]
+    assert [a.name for a in suite.annotations] == ['system-err']
+    assert [s.name for s in suite.sub_suites] == ['tests.test_a', 'tests.test_b']
+    assert rows(suite.sub_suites[0]) == [('test_pass', 'passed', 250), ('test_fail', 'failed', 500)]
+    assert rows(suite.sub_suites[1]) == [('test_skip', 'not_applicable', 0), ('test_error', 'errored', 100)]
+
+    failed = list(suite.sub_suites[0].iter_test_cases())[1]
+    annotations = dict((a.name, a) for a in failed.annotations)
+    assert annotations['Error'].description == 'assert 1 == 2'
+    assert annotations['failure'].read_payload() == b'Traceback\nAssertionError'
+    assert annotations['system-out'].read_payload() == b'captured out'
+
+
+def test_convert_flat_gzip_input(tmp_path):
+    source = tmp_path / 'junit.xml.gz'
+    source.write_bytes(gzip.compress(JUNIT_PYTEST))
+    out_file = str(tmp_path / 'testspace.xml')
+    junit.main([str(source), '-o', out_file, '--flat', '--pretty'])
+
+    suite = load_report(out_file).sub_suites[0]
+    assert suite.sub_suites == []
+    assert [row[0] for row in rows(suite)] == ['test_pass', 'test_fail', 'test_skip', 'test_error']
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_convert_multiple_files(tmp_path, max_workers):
+    sources = []
+    for index, content in enumerate([JUNIT_JAVA, JUNIT_PYTEST, JUNIT_JAVA]):
+        source = tmp_path / 'junit{0}.xml'.format(index)
+        source.write_bytes(content)
+        sources.append(str(source))
+    out_file = str(tmp_path / 'testspace.xml')
+    junit.convert_files(sources, out_file, max_workers=max_workers)
+
+    report = load_report(out_file)
+    assert [s.name for s in report.sub_suites] == ['com.example.CalcTest', 'pytest']
+    java_suite = report.sub_suites[0]
+    assert java_suite.sub_suites == []
+    assert [row[0] for row in rows(java_suite)] == ['adds', 'divides', 'adds', 'divides']
+    assert java_suite.duration == pytest.approx(40)
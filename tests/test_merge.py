@@ -0,0 +1,93 @@
+import io
+
+import pytest
+from lxml import etree
+
+from python_testspace_xml import merge, testspace_xml
+
+
+def build_shard(index):
+    report = testspace_xml.TestspaceReport()
+    report.set_product_version('shard {0}'.format(index))
+    suite = report.get_or_add_suite_path(['pkg', 'module'])
+    suite.set_duration(1.5)
+    if index == 1:
+        suite.set_description('described by shard 1')
+    suite.add_text_annotation('shard {0} note'.format(index))
+    suite.add_custom_metric('shard', str(index))
+    for c in range(3):
+        test_case = testspace_xml.TestCase('case {0}.{1}'.format(index, c))
+        test_case.add_string_buffer_annotation('output', u'caf\xe9 {0}\n'.format(c) * 100)
+        suite.add_test_case(test_case)
+    report.get_or_add_test_suite('only in {0}'.format(index)).add_test_case(testspace_xml.TestCase('x'))
+    return report
+
+
+def write_to_string(report):
+    out = io.StringIO()
+    report.write_xml(out, to_pretty=True, streaming=True)
+    return out.getvalue()
+
+
+@pytest.fixture
+def shard_files(tmp_path):
+    paths = []
+    for index in range(3):
+        path = str(tmp_path / 'shard{0}.xml'.format(index))
+        build_shard(index).write_xml(path, to_pretty=True)
+        paths.append(path)
+    return paths
+
+
+def test_merge_in_memory():
+    merged = merge.merge_reports([build_shard(i) for i in range(3)])
+    assert merged.product_version == 'shard 0'
+    assert [s.name for s in merged.sub_suites] == ['pkg', 'only in 0', 'only in 1', 'only in 2']
+    module = merged.get_or_add_suite_path(['pkg', 'module'])
+    assert len(module.test_cases) == 9
+    assert module.duration == 4.5
+    assert module.description == 'described by shard 1'
+
+
+def test_merge_columnar_reports():
+    shards = []
+    for index in range(2):
+        report = testspace_xml.TestspaceReport()
+        suite = report.get_or_add_test_suite('bulk')
+        suite.add_test_cases_from_records([('case {0}.0'.format(index), 'passed', 1),
+                                           ('case {0}.1'.format(index), 'failed', 2, None, 'described')])
+        suite.test_case_columns.view(1).add_info_annotation('promoted')
+        shards.append(report)
+
+    merged = merge.merge_reports(shards)
+    bulk = merged.get_or_add_test_suite('bulk')
+    assert [tc.name for tc in bulk.iter_test_cases()] == ['case 0.0', 'case 0.1', 'case 1.0', 'case 1.1']
+    assert [tc.description for tc in bulk.iter_test_cases()] == ['', 'described', '', 'described']
+    assert merged.get_rollup()['statuses'] == {'passed': 2, 'failed': 2}
+    assert merged.get_rollup()['duration'] == 6
+    assert merged.get_rollup()['annotations'] == 2
+    assert write_to_string(merged).count('description="promoted"') == 2
+
+
+@pytest.mark.parametrize('max_workers', [1, 2])
+def test_streaming_merge_matches_in_memory(tmp_path, shard_files, max_workers):
+    expected = write_to_string(merge.merge_reports(shard_files))
+    out_file = str(tmp_path / 'merged.xml')
+    merge.write_merged_report(shard_files, out_file, to_pretty=True, max_workers=max_workers)
+    with io.open(out_file, encoding='utf-8') as file_obj:
+        assert file_obj.read() == expected
+
+
+def test_streaming_merge_mixed_sources(shard_files):
+    sources = [build_shard(5)] + shard_files
+    expected = write_to_string(merge.merge_reports([build_shard(5)] + shard_files))
+    out = io.StringIO()
+    merge.write_merged_report(sources, out, to_pretty=True)
+    assert out.getvalue() == expected
+
+
+def test_merge_command(tmp_path, shard_files):
+    out_file = str(tmp_path / 'merged.xml')
+    assert merge.main(['-o', out_file, '-j', '2'] + shard_files) == 0
+    root = etree.parse(out_file).getroot()
+    assert len(root.xpath("//test_suite[@name='module']/test_case")) == 9
@@ -0,0 +1,99 @@
+import io
+
+import pytest
+from lxml import etree
+
+from python_testspace_xml import testspace_xml
+
+
+def build_report(tmp_path, sizes, lazy=True):
+    report = testspace_xml.TestspaceReport()
+    suite = report.get_or_add_test_suite('suite')
+    for c, case_sizes in enumerate(sizes):
+        test_case = testspace_xml.TestCase('case {0}'.format(c))
+        for a, size in enumerate(case_sizes):
+            log_path = tmp_path / 'log_{0}_{1}.txt'.format(c, a)
+            log_path.write_bytes(b'HEAD' + b'x' * (size - 8) + b'TAIL')
+            test_case.add_file_annotation('log {0}'.format(a), str(log_path), lazy=lazy)
+        suite.add_test_case(test_case)
+    return report
+
+
+def payloads(report):
+    return [a.read_payload() for a in report.iter_annotations()]
+
+
+@pytest.mark.parametrize('lazy', [True, False])
+def test_annotation_budget_truncates(tmp_path, lazy):
+    report = build_report(tmp_path, [[100000, 500]], lazy)
+    report.set_payload_budget(max_annotation_bytes=4096)
+    report.write_xml(io.StringIO())
+
+    truncated, small = payloads(report)
+    assert len(truncated) <= 4096
+    assert truncated.startswith(b'HEAD') and truncated.endswith(b'TAIL')
+    assert b'bytes truncated' in truncated
+    assert len(small) == 500
+    annotation = next(report.iter_annotations())
+    assert annotation.comments[0].name == 'payload_budget'
+    stats = report.get_stats()['payload_budget']
+    assert stats['truncated'] == 1
+    assert stats['bytes_removed'] == 100000 - len(truncated) + len(b'\n\n... 95925 bytes truncated ...\n\n')
+
+
+def test_annotation_budget_applied_when_added(tmp_path, monkeypatch):
+    compressed = []
+    gzip_bytes = testspace_xml.gzip_bytes
+    monkeypatch.setattr(testspace_xml, 'gzip_bytes', lambda data, *args: compressed.append(len(data)) or
+                        gzip_bytes(data, *args))
+    monkeypatch.setattr(testspace_xml, 'gzip_file', None)
+    log_path = tmp_path / 'log.txt'
+    log_path.write_bytes(b'HEAD' + b'x' * 99992 + b'TAIL')
+    report = testspace_xml.TestspaceReport()
+    report.set_payload_budget(max_annotation_bytes=4096)
+    test_case = report.get_or_add_test_suite('suite').add_test_case(testspace_xml.TestCase('case'))
+    from_file = test_case.add_file_annotation('log', str(log_path))
+    from_buffer = test_case.add_string_buffer_annotation('out', 'o' * 100000)
+
+    # only the truncated payloads were compressed
+    assert compressed == [4096, 4096]
+    for annotation in (from_file, from_buffer):
+        assert annotation.comments[0].name == 'payload_budget'
+        assert len(annotation.read_payload()) == 4096
+    assert from_file.read_payload().endswith(b'TAIL')
+    report.write_xml(io.StringIO())
+    assert report.get_stats()['payload_budget']['truncated'] == 2
+
+
+def test_test_case_and_total_budgets(tmp_path):
+    report = build_report(tmp_path, [[3000, 3000, 3000], [3000, 3000]])
+    report.set_payload_budget(max_test_case_bytes=5000, max_total_bytes=7000)
+    report.apply_payload_budget()
+
+    sizes = [len(p or b'') for p in payloads(report)]
+    assert sizes[0] == 3000
+    assert sizes[1] <= 2000
+    assert sizes[2] == 0
+    assert sum(sizes) <= 7000
+    assert report.get_stats()['payload_budget']['embedded_bytes'] == sum(sizes)
+
+
+def test_overflow_link(tmp_path):
+    report = build_report(tmp_path, [[10000]])
+    report.get_or_add_test_suite('suite').add_string_buffer_annotation('out', 'o' * 10000)
+    report.set_payload_budget(max_annotation_bytes=1000, overflow='link', spill_dir=str(tmp_path / 'spill'))
+
+    out = io.StringIO()
+    report.write_xml(out)
+    root = etree.fromstring(out.getvalue().encode())
+    files = [a.get('file') for a in root.iter('annotation')]
+    assert all(a.get('link_file') == 'true' for a in root.iter('annotation'))
+    assert files[0].endswith('spill/1-out')
+    assert files[1].endswith('log_0_0.txt')
+    assert (tmp_path / 'spill' / '1-out').read_bytes() == b'o' * 10000
+    assert report.get_stats()['payload_budget']['linked'] == 2
+
+
+def test_unknown_overflow():
+    with pytest.raises(ValueError):
+        testspace_xml.TestspaceReport().set_payload_budget(1000, overflow='drop')
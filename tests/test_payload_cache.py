@@ -0,0 +1,138 @@
+import gzip
+import io
+import os
+
+import pytest
+
+from python_testspace_xml import testspace_xml
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(testspace_xml, 'payload_cache', None)
+    return str(tmp_path / 'cache')
+
+
+def write_log(path, content):
+    path.write_bytes(content)
+    return str(path)
+
+
+def no_compression(*args, **kwargs):
+    raise AssertionError('payload compressed again')
+
+
+def test_cache_across_runs(tmp_path, cache_dir, monkeypatch):
+    log_path = write_log(tmp_path / 'toolchain.log', b'toolchain output\n' * 5000)
+    cache = testspace_xml.set_payload_cache(cache_dir)
+    first = testspace_xml.Annotation('log')
+    first.set_file(log_path)
+    assert cache.stats()['misses'] == 1
+
+    # a later run, the payload comes from disk
+    cache = testspace_xml.set_payload_cache(cache_dir)
+    monkeypatch.setattr(testspace_xml, 'iter_gzip_file', no_compression)
+    second = testspace_xml.Annotation('log')
+    second.set_file(log_path)
+    assert second.gzip_data == first.gzip_data
+    assert cache.stats()['hits'] == 1
+
+    # touched but unchanged, found by content hash
+    os.utime(log_path, (1000000000, 1000000000))
+    third = testspace_xml.Annotation('log')
+    third.set_file(log_path)
+    assert third.gzip_data == first.gzip_data
+    assert cache.stats() == {'hits': 2, 'misses': 0, 'evictions': 0, 'entries': 1, 'bytes': len(first.gzip_data)}
+
+
+def test_changed_file_misses(tmp_path, cache_dir):
+    log_path = tmp_path / 'fixture.dump'
+    cache = testspace_xml.set_payload_cache(cache_dir)
+    for content in (b'first version', b'second version'):
+        write_log(log_path, content)
+        annotation = testspace_xml.Annotation('dump')
+        annotation.set_file(str(log_path))
+        assert annotation.read_payload() == content
+    assert cache.stats()['misses'] == 2
+
+
+def test_lazy_report_output_uses_cache(tmp_path, cache_dir):
+    log_path = write_log(tmp_path / 'big.log', b'line\n' * 100000)
+    expected = io.StringIO()
+    report = testspace_xml.TestspaceReport()
+    report.get_or_add_test_suite('suite').add_file_annotation('log', log_path, lazy=True)
+    report.write_xml(expected, streaming=True)
+
+    cache = testspace_xml.set_payload_cache(cache_dir)
+    for run in range(2):
+        out = io.StringIO()
+        report = testspace_xml.TestspaceReport()
+        report.get_or_add_test_suite('suite').add_file_annotation('log', log_path, lazy=True)
+        report.write_xml(out, streaming=True)
+        assert out.getvalue() == expected.getvalue()
+    assert report.get_stats()['payload_cache']['hits'] == 1
+    assert not [name for name in os.listdir(cache.payload_dir) if name.endswith('.tmp')]
+
+
+def test_lru_eviction(tmp_path, cache_dir):
+    paths = [write_log(tmp_path / 'log{0}'.format(i), os.urandom(4000)) for i in range(3)]
+    cache = testspace_xml.set_payload_cache(cache_dir, max_bytes=9000)
+    testspace_xml.gzip_file(paths[0])
+    testspace_xml.gzip_file(paths[1])
+    testspace_xml.gzip_file(paths[0])
+    testspace_xml.gzip_file(paths[2])
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1 and stats['entries'] == 2
+    assert len(os.listdir(cache.key_dir)) == 2
+    assert cache.lookup(paths[0])[0] is not None
+    assert cache.lookup(paths[1])[0] is None
+
+
+def test_gzipped_file_passed_through(tmp_path, cache_dir, monkeypatch):
+    data = b'already compressed\n' * 1000
+    gz_path = write_log(tmp_path / 'trace.log.gz', gzip.compress(data))
+    monkeypatch.setattr(testspace_xml, 'iter_gzip_file', no_compression)
+    annotation = testspace_xml.Annotation('trace')
+    annotation.set_file(gz_path, gzipped=True)
+    with open(gz_path, 'rb') as file_obj:
+        assert annotation.gzip_data == file_obj.read()
+    assert annotation.read_payload() == data
+    assert annotation.raw_bytes == len(data)
+    assert ('file_name', 'trace.log') in annotation.xml_attributes()
+
+
+def test_lazy_gzipped_file_streamed(tmp_path, cache_dir, monkeypatch):
+    data = b'already compressed\n' * 1000
+    gz_path = write_log(tmp_path / 'trace.log.gz', gzip.compress(data))
+    monkeypatch.setattr(testspace_xml, 'iter_gzip_file', no_compression)
+    report = testspace_xml.TestspaceReport()
+    annotation = report.add_file_annotation('trace', gz_path, lazy=True, gzipped=True)
+    assert annotation.gzip_data is None
+    assert not annotation.is_pending()
+    assert annotation.raw_bytes == len(data)
+    with open(gz_path, 'rb') as file_obj:
+        assert b''.join(annotation.iter_gzip_chunks()) == file_obj.read()
+    assert annotation.gzip_data is None
+
+    out = io.StringIO()
+    report.write_xml(out, streaming=True)
+    eager = testspace_xml.TestspaceReport()
+    eager.add_file_annotation('trace', gz_path, gzipped=True)
+    expected = io.StringIO()
+    eager.write_xml(expected, streaming=True)
+    assert out.getvalue() == expected.getvalue()
+
+
+def test_gzipped_file_budget_uses_uncompressed_size(tmp_path):
+    data = b'HEAD' + b'x' * 100000 + b'TAIL'
+    gz_path = write_log(tmp_path / 'trace.log.gz', gzip.compress(data))
+    report = testspace_xml.TestspaceReport()
+    annotation = report.add_file_annotation('trace', gz_path, lazy=True, gzipped=True)
+    report.set_payload_budget(max_annotation_bytes=4096)
+    report.write_xml(io.StringIO())
+
+    payload = annotation.read_payload()
+    assert len(payload) <= 4096
+    assert payload.startswith(b'HEAD') and payload.endswith(b'TAIL')
+    assert report.get_stats()['payload_budget']['truncated'] == 1
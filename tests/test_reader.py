@@ -0,0 +1,70 @@
+import io
+
+from python_testspace_xml import reader, testspace_xml
+
+
+def build_report():
+    report = testspace_xml.TestspaceReport()
+    report.set_product_version('pytest')
+    suite = report.get_or_add_suite_path(['pkg', 'module'])
+    suite.set_description('module suite')
+    suite.set_duration(12.5)
+    suite.add_link_annotation('https://testspace.com')
+    suite.add_string_buffer_annotation('log', 'suite log\n' * 50)
+    suite.add_custom_metric('stats', '1, 2')
+
+    test_case = testspace_xml.TestCase('passing', 'passed')
+    test_case.set_start_time('2024-01-01T00:00:00')
+    test_case.set_duration(3)
+    annotation = test_case.add_string_buffer_annotation('output', 'case output')
+    annotation.add_comment('label', 'comment text')
+    suite.add_test_case(test_case)
+
+    test_case = testspace_xml.TestCase('failing')
+    test_case.fail('broken')
+    test_case.add_custom_metric('metric', '42')
+    suite.add_test_case(test_case)
+    report.get_or_add_test_suite('other').add_test_case(testspace_xml.TestCase('lonely', 'not_applicable'))
+    return report
+
+
+def write_to_string(report, to_pretty=True):
+    out = io.StringIO()
+    report.write_xml(out, to_pretty=to_pretty, streaming=True)
+    return out.getvalue()
+
+
+def test_round_trip():
+    for to_pretty in (True, False):
+        original = write_to_string(build_report(), to_pretty)
+        loaded = reader.load_report(io.BytesIO(original.encode('utf-8')))
+        assert write_to_string(loaded, to_pretty) == original
+
+
+def test_payloads_decoded_lazily():
+    original = write_to_string(build_report())
+    loaded = reader.load_report(io.BytesIO(original.encode('utf-8')))
+    annotation = loaded.get_or_add_suite_path(['pkg', 'module']).test_cases[0].annotations[0]
+    assert annotation.gzip_data is None
+    assert annotation.b64_data
+    assert annotation.read_payload() == b'case output'
+    assert annotation.comments[0].comment == 'comment text'
+
+
+def test_skip_payloads():
+    original = write_to_string(build_report())
+    loaded = reader.load_report(io.BytesIO(original.encode('utf-8')), load_payloads=False)
+    annotation = loaded.get_or_add_suite_path(['pkg', 'module']).annotations[1]
+    assert annotation.name == 'log'
+    assert not annotation.has_data()
+
+
+def test_iter_test_cases():
+    original = write_to_string(build_report())
+    cases = list(reader.iter_test_cases(io.BytesIO(original.encode('utf-8'))))
+    assert [(path, tc.name, tc.status) for path, tc in cases] == [
+        (('pkg', 'module'), 'passing', 'passed'),
+        (('pkg', 'module'), 'failing', 'failed'),
+        (('other',), 'lonely', 'not_applicable')]
+    assert [a.name for a in cases[1][1].annotations] == ['Error']
+    assert cases[1][1].custom_data[0].value == '42'
@@ -0,0 +1,98 @@
+import io
+
+from lxml import etree
+
+from python_testspace_xml import testspace_xml
+from python_testspace_xml.reader import load_report
+
+
+def walk_rollup(suite):
+    # the totals computed the slow way
+    statuses = {}
+    test_cases = annotations = suites = 0
+    duration = 0
+    stack = [suite]
+    while stack:
+        current = stack.pop()
+        annotations += len(current.annotations)
+        for row in current.iter_test_case_rows():
+            test_cases += 1
+            statuses[row[2]] = statuses.get(row[2], 0) + 1
+            duration += row[4]
+            annotations += len(row[5])
+        suites += len(current.sub_suites)
+        stack.extend(current.sub_suites)
+    return {'test_cases': test_cases, 'statuses': statuses, 'duration': duration,
+            'annotations': annotations, 'suites': suites}
+
+
+def build_report():
+    report = testspace_xml.TestspaceReport()
+    suite = report.get_or_add_test_suite('suite')
+    child = suite.get_or_add_test_suite('child')
+    for i in range(6):
+        test_case = testspace_xml.TestCase('case {0}'.format(i))
+        test_case.set_duration(10)
+        child.add_test_case(test_case)
+        if i % 2:
+            test_case.fail('broken')
+        test_case.set_duration(i)
+    suite.add_text_annotation('note')
+
+    detached = testspace_xml.TestSuite('detached')
+    detached.add_test_case(testspace_xml.TestCase('blocked', 'blocked'))
+    suite.add_test_suite(detached)
+
+    bulk = report.get_or_add_test_suite('bulk')
+    bulk.add_test_cases_from_columns(['a', 'b', 'c'], ['passed', 'failed', 'passed'], [1, 2, 3])
+    bulk.set_columnar()
+    bulk.add_test_case(testspace_xml.TestCase('d'))
+    view = next(iter(bulk.iter_test_cases()))
+    view.set_status('errored')
+    view.add_info_annotation('promoted')
+    return report
+
+
+def test_rollup_matches_walk():
+    report = build_report()
+    for suite in [report, report.sub_suites[0], report.sub_suites[0].sub_suites[0], report.sub_suites[1]]:
+        assert suite.get_rollup() == walk_rollup(suite)
+    assert report.get_rollup()['statuses'] == {'passed': 5, 'failed': 4, 'errored': 1, 'blocked': 1}
+
+
+def test_rollup_of_loaded_report():
+    out = io.StringIO()
+    build_report().write_xml(out)
+    report = load_report(io.BytesIO(out.getvalue().encode()))
+    assert report.get_rollup() == walk_rollup(report)
+
+
+def test_rollup_custom_data():
+    report = build_report()
+    report.set_rollup_custom_data()
+    out = io.StringIO()
+    report.write_xml(out, streaming=True)
+    root = etree.fromstring(out.getvalue().encode())
+    child = root.find('test_suite/test_suite')
+    data = dict((d.get('name'), d.text) for d in child.findall('custom_data'))
+    assert data == {'rollup_test_cases': '6', 'rollup_passed': '3', 'rollup_failed': '3',
+                    'rollup_duration': '15', 'rollup_annotations': '3'}
+
+    dom_out = io.StringIO()
+    report.write_xml(dom_out)
+    assert dom_out.getvalue() == out.getvalue()
+
+
+def test_incremental_writer_rollup(tmp_path):
+    out_file = str(tmp_path / 'report.xml')
+    with testspace_xml.IncrementalXmlWriter(out_file, rollup_custom_data=True) as writer:
+        writer.add_test_case_to_path(['a', 'b'], testspace_xml.TestCase('one'))
+        writer.add_test_case_to_path(['a', 'c'], testspace_xml.TestCase('two', 'failed'))
+        progress = writer.report.get_rollup()
+    assert progress['test_cases'] == 2 and progress['suites'] == 3
+    assert progress['statuses'] == {'passed': 1, 'failed': 1}
+
+    report = load_report(out_file)
+    suite_a = report.sub_suites[0]
+    assert [(d.name, d.value) for d in suite_a.custom_data][:3] == [
+        ('rollup_test_cases', '2'), ('rollup_failed', '1'), ('rollup_passed', '1')]
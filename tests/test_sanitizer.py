@@ -0,0 +1,51 @@
+from collections import OrderedDict
+
+from python_testspace_xml import testspace_xml
+
+
+def test_illegal_characters_removed():
+    sanitizer = testspace_xml.XmlSanitizer()
+    assert sanitizer.clean(u'bad \x00char\x1f ￾') == u'bad char '
+    assert sanitizer.changed == 1
+
+
+def test_printable_ascii_unchanged():
+    sanitizer = testspace_xml.XmlSanitizer()
+    assert sanitizer.clean('Error') == 'Error'
+    assert sanitizer.stats()['fast_path'] == 1
+    assert sanitizer.stats()['cache_size'] == 0
+
+
+def test_repeated_strings_cached():
+    sanitizer = testspace_xml.XmlSanitizer()
+    for _ in range(3):
+        assert sanitizer.clean(u'caf\xe9\n') == u'caf\xe9\n'
+    assert sanitizer.cache_hits == 2
+    assert sanitizer.changed == 0
+
+
+def test_cache_is_bounded():
+    sanitizer = testspace_xml.XmlSanitizer(max_cache_size=2)
+    for name in (u'\xe91', u'\xe92', u'\xe93'):
+        sanitizer.clean(name)
+    assert list(sanitizer.cache) == [u'\xe92', u'\xe93']
+
+
+def test_non_string_is_empty():
+    assert testspace_xml.XmlWriter.invalid_xml_remove(None) == ''
+
+
+def test_entry_removed_by_another_thread():
+    class RacingCache(OrderedDict):
+        def get(self, key, default=None):
+            value = OrderedDict.get(self, key, default)
+            # another thread refreshes or evicts the entry right after the lookup
+            self.pop(key, None)
+            return value
+
+    sanitizer = testspace_xml.XmlSanitizer()
+    sanitizer.cache = RacingCache()
+    for _ in range(2):
+        assert sanitizer.clean(u'caf\xe9') == u'caf\xe9'
+    assert sanitizer.cache_hits == 1
+    assert list(sanitizer.cache) == [u'caf\xe9']
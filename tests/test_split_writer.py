@@ -0,0 +1,69 @@
+import io
+import os
+
+import pytest
+from lxml import etree
+
+from python_testspace_xml import reader, testspace_xml
+
+
+def build_report():
+    report = testspace_xml.TestspaceReport()
+    report.set_product_version('pytest')
+    report.add_text_annotation('root note')
+    for s in range(6):
+        suite = report.get_or_add_suite_path(['top', 'suite {0}'.format(s)])
+        for c in range(4):
+            test_case = testspace_xml.TestCase('case {0}'.format(c))
+            test_case.add_string_buffer_annotation('log', os.urandom(1500).hex())
+            suite.add_test_case(test_case)
+    return report
+
+
+def case_paths(files):
+    paths = []
+    for file_name in files:
+        paths.extend((path, tc.name) for path, tc in reader.iter_test_cases(file_name))
+    return paths
+
+
+def test_split_at_suite_boundaries(tmp_path):
+    out_file = str(tmp_path / 'report.xml')
+    report = build_report()
+    files = report.write_xml(out_file, to_pretty=True, max_bytes=20000)
+    assert files[0] == out_file
+    assert files[1] == str(tmp_path / 'report.2.xml')
+    assert len(files) > 2
+
+    for file_name in files:
+        assert os.path.getsize(file_name) <= 20000
+        root = etree.parse(file_name).getroot()
+        assert root.get('product_version') == 'pytest'
+        # each part reopens the enclosing suite
+        assert root.xpath('/reporter/test_suite/@name') == ['top']
+    assert len(etree.parse(files[0]).getroot().xpath('/reporter/annotation')) == 1
+
+    single = str(tmp_path / 'single.xml')
+    report.write_xml(single, to_pretty=True)
+    assert case_paths(files) == case_paths([single])
+
+
+def test_no_split_when_small(tmp_path):
+    out_file = str(tmp_path / 'report.xml')
+    report = build_report()
+    assert report.write_xml(out_file, max_bytes=10 ** 9) == [out_file]
+    plain_file = str(tmp_path / 'plain.xml')
+    report.write_xml(plain_file)
+    with open(out_file) as split_obj, open(plain_file) as plain_obj:
+        assert split_obj.read() == plain_obj.read()
+
+
+def test_empty_report(tmp_path):
+    out_file = str(tmp_path / 'empty.xml')
+    assert testspace_xml.TestspaceReport().write_xml(out_file, max_bytes=100) == [out_file]
+    assert etree.parse(out_file).getroot().tag == 'reporter'
+
+
+def test_split_needs_file_path():
+    with pytest.raises(ValueError, match='file path'):
+        build_report().write_xml(io.StringIO(), max_bytes=20000)
@@ -0,0 +1,121 @@
+import base64
+import gzip
+import io
+import re
+import sys
+
+import pytest
+
+from python_testspace_xml import reader, testspace_xml
+
+
+def build_report():
+    report = testspace_xml.TestspaceReport()
+    report.set_product_version('pytest')
+
+    suite = report.get_or_add_test_suite('Example <Suite>')
+    suite.set_description('https://testspace.com')
+    suite.set_duration_ms(12.5)
+    suite.add_link_annotation('https://help.testspace.com')
+    suite.add_string_buffer_annotation('buffer', 'line 1\nline 2')
+    suite.add_text_annotation('text', description='description only')
+    suite.add_file_annotation('tests/report_v1.xsd', file_path='tests/report_v1.xsd')
+    suite.add_custom_metric('suite stats', '0, 3, 4')
+
+    annotation = testspace_xml.Annotation('with comments')
+    annotation.add_comment('first', 'comment 1')
+    annotation.add_comment('second', 'comment 2')
+    suite.add_annotation(annotation)
+
+    data_annotation = testspace_xml.Annotation('data with comment')
+    data_annotation.set_buffer(b'payload')
+    data_annotation.add_comment('label', 'comment')
+    suite.add_annotation(data_annotation)
+
+    test_case = testspace_xml.TestCase('failing case \x01', 'passed')
+    test_case.set_start_time('2020-01-01T00:00:00')
+    test_case.fail('failed')
+    test_case.add_custom_metric('metric', '1')
+    suite.add_test_case(test_case)
+    suite.add_test_case(testspace_xml.TestCase('empty case'))
+
+    report.add_test_suite('empty suite')
+    report.get_or_add_test_suite('nested').add_test_suite('child').add_test_case(
+        testspace_xml.TestCase('deep'))
+    return report
+
+
+def write_to_string(report, to_pretty, streaming):
+    out = io.StringIO()
+    report.write_xml(out, to_pretty=to_pretty, streaming=streaming)
+    xml = out.getvalue()
+    if to_pretty and not streaming and sys.version_info < (3, 8):
+        # older minidom pretty prints a lone CDATA child on its own line
+        xml = re.sub(r'>\n(<!\[CDATA\[(?:(?!\]\]>).)*\]\]>)\t</', r'>\1</', xml, flags=re.S)
+    return xml
+
+
+def test_streaming_matches_dom_pretty():
+    report = build_report()
+    assert write_to_string(report, True, True) == write_to_string(report, True, False)
+
+
+def test_streaming_matches_dom_compact():
+    report = build_report()
+    assert write_to_string(report, False, True) == write_to_string(report, False, False)
+
+
+def test_streaming_empty_report():
+    report = testspace_xml.TestspaceReport()
+    assert write_to_string(report, True, True) == write_to_string(report, True, False)
+
+
+def test_streaming_rejects_cdata_terminator():
+    report = testspace_xml.TestspaceReport()
+    report.add_custom_metric('bad', 'a]]>b')
+    with pytest.raises(ValueError):
+        write_to_string(report, False, True)
+
+
+def test_lazy_file_annotation_matches_eager(tmp_path):
+    log_path = tmp_path / 'big.log'
+    log_path.write_bytes(b''.join(b'line %d\n' % i for i in range(100000)))
+
+    report = testspace_xml.TestspaceReport()
+    suite = report.get_or_add_test_suite('suite')
+    lazy = suite.add_file_annotation('log', str(log_path), lazy=True)
+    lazy.add_comment('note', 'comment')
+    assert lazy.gzip_data is None
+
+    eager = testspace_xml.Annotation('log')
+    eager.set_buffer(log_path.read_bytes())
+    assert gzip.decompress(b''.join(lazy.iter_gzip_chunks())) == eager.read_payload() == log_path.read_bytes()
+    assert ''.join(lazy.iter_base64_chunks()) == \
+        base64.b64encode(b''.join(lazy.iter_gzip_chunks())).decode()
+
+    assert write_to_string(report, True, True) == write_to_string(report, True, False)
+
+
+def test_lazy_file_annotation_missing_file():
+    annotation = testspace_xml.Annotation('missing')
+    annotation.set_file('/does/not/exist', lazy=True)
+    assert annotation.level == 'error'
+    assert not annotation.has_data()
+
+
+def test_base64_chunks_concatenate():
+    data = bytes(bytearray(range(256))) * 7
+    pieces = [data[i:i + 10] for i in range(0, len(data), 10)]
+    assert ''.join(testspace_xml.iter_base64(pieces, chunk_size=8)) == base64.b64encode(data).decode()
+
+
+def test_streaming_keeps_whitespace_in_attributes():
+    report = testspace_xml.TestspaceReport()
+    test_case = testspace_xml.TestCase('case')
+    test_case.set_description('line1\nline2\ttab')
+    report.get_or_add_test_suite('suite').add_test_case(test_case)
+
+    xml = write_to_string(report, False, True)
+    assert 'description="line1&#10;line2&#9;tab"' in xml
+    loaded = reader.load_report(io.BytesIO(xml.encode('utf-8')))
+    assert loaded.get_or_add_test_suite('suite').test_cases[0].description == 'line1\nline2\ttab'
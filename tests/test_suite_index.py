@@ -0,0 +1,37 @@
+from python_testspace_xml import testspace_xml
+
+
+def test_get_or_add_reuses_suite():
+    report = testspace_xml.TestspaceReport()
+    first = report.get_or_add_test_suite('a')
+    report.get_or_add_test_suite('b')
+    assert report.get_or_add_test_suite('a') is first
+    assert [suite.name for suite in report.sub_suites] == ['a', 'b']
+
+
+def test_first_duplicate_name_wins():
+    report = testspace_xml.TestspaceReport()
+    first = report.add_test_suite('dup')
+    report.add_test_suite('dup')
+    assert report.get_or_add_test_suite('dup') is first
+    assert len(report.sub_suites) == 2
+
+
+def test_index_follows_direct_list_changes():
+    report = testspace_xml.TestspaceReport()
+    suite = testspace_xml.TestSuite('direct')
+    report.sub_suites.append(suite)
+    assert report.get_or_add_test_suite('direct') is suite
+    report.sub_suites.remove(suite)
+    assert report.get_or_add_test_suite('direct') is not suite
+
+
+def test_suite_path():
+    report = testspace_xml.TestspaceReport()
+    leaf = report.get_or_add_suite_path(['pkg', 'module', 'Class'])
+    assert leaf.name == 'Class'
+    assert report.get_or_add_suite_path(['pkg', 'module', 'Class']) is leaf
+    module = report.get_or_add_test_suite('pkg').get_or_add_test_suite('module')
+    assert module.sub_suites == [leaf]
+    assert report.get_or_add_suite_path([]) is report
+    assert report.get_or_add_suite_path(['pkg', '']).name == 'uncategorized'
@@ -0,0 +1,94 @@
+import asyncio
+import io
+
+import pytest
+
+from python_testspace_xml import testspace_xml
+
+
+def build_report(tmp_path):
+    report = testspace_xml.TestspaceReport()
+    log_path = tmp_path / 'log.txt'
+    log_path.write_bytes(b'log line\n' * 1000)
+    suite = report.get_or_add_test_suite('suite')
+    sub_suite = suite.get_or_add_test_suite('sub suite')
+    for c in range(3):
+        test_case = testspace_xml.TestCase('case {0}'.format(c))
+        test_case.add_file_annotation('log', str(log_path), lazy=True)
+        test_case.add_custom_metric('key', 'value')
+        sub_suite.add_test_case(test_case)
+    suite.add_string_buffer_annotation('out', 'output\n' * 100)
+    return report
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_write_stats(tmp_path, streaming):
+    report = build_report(tmp_path)
+    received = []
+    report.enable_stats(callback=received.append)
+    report.write_xml(io.StringIO(), to_pretty=True, streaming=streaming)
+
+    stats = report.get_stats()['write']
+    assert received == [stats]
+    assert stats['counts']['suites'] == 2
+    assert stats['counts']['test_cases'] == 3
+    assert stats['counts']['annotations'] == 4
+    assert stats['counts']['custom_data'] == 3
+    assert stats['counts']['annotation_raw_bytes'] == 3 * 9000 + 700
+    assert stats['counts']['annotation_encoded_bytes'] > 0
+    phases = stats['phase_seconds']
+    for phase in ('serialization', 'sanitize', 'gzip', 'base64', 'io', 'other'):
+        assert phase in phases
+    assert sum(phases.values()) == pytest.approx(stats['total_seconds'])
+    # only the DOM writer builds a tree
+    assert ('tree_building' in phases) == (not streaming)
+    assert stats['peak_rss_bytes'] > 0
+
+
+def test_split_write_counts_each_suite_once(tmp_path):
+    report = build_report(tmp_path)
+    for s in range(5):
+        report.get_or_add_test_suite('extra {0}'.format(s)).add_string_buffer_annotation('out', 'x' * 3000)
+    report.enable_stats()
+    files = report.write_xml(str(tmp_path / 'split.xml'), max_bytes=8000)
+
+    assert len(files) > 1
+    counts = report.get_stats()['write']['counts']
+    assert counts['suites'] == 7
+    assert counts['test_cases'] == 3
+    assert counts['annotations'] == 9
+
+
+def test_write_xml_async_stats(tmp_path):
+    report = build_report(tmp_path)
+    received = []
+    report.enable_stats(callback=received.append)
+    asyncio.run(report.write_xml_async(str(tmp_path / 'async.xml'), to_pretty=True))
+
+    stats = report.get_stats()['write']
+    assert received == [stats]
+    assert stats['counts']['suites'] == 2
+    assert stats['counts']['test_cases'] == 3
+    assert stats['counts']['annotations'] == 4
+    assert stats['counts']['custom_data'] == 3
+    assert 'serialization' in stats['phase_seconds']
+    assert 'tree_building' not in stats['phase_seconds']
+    assert testspace_xml.WriteStats.active is None
+
+
+def test_output_unchanged_with_stats(tmp_path):
+    expected = io.StringIO()
+    build_report(tmp_path).write_xml(expected, to_pretty=True)
+    report = build_report(tmp_path)
+    report.enable_stats(trace_memory=True)
+    out = io.StringIO()
+    report.write_xml(out, to_pretty=True)
+    assert out.getvalue() == expected.getvalue()
+    assert report.get_stats()['write']['peak_traced_bytes'] > 0
+    assert testspace_xml.WriteStats.active is None
+
+
+def test_stats_disabled_by_default(tmp_path):
+    report = build_report(tmp_path)
+    report.write_xml(io.StringIO())
+    assert 'write' not in report.get_stats()